@@ -6,55 +6,104 @@ of the Piano Chorus Creator backend.
 """
 
 import os
+import time
 import uuid
 import logging
 import tempfile
-import shutil
-from typing import Dict, List, Optional
-from fastapi import FastAPI, UploadFile, File, Form, HTTPException, BackgroundTasks
-from fastapi.responses import FileResponse
-from fastapi.middleware.cors import CORSMiddleware
+import multiprocessing
+from functools import partial
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from typing import Optional
+from fastapi import FastAPI, UploadFile, File, Form, HTTPException, BackgroundTasks, Depends, Request, Response
+from fastapi.responses import ORJSONResponse, StreamingResponse
+from starlette.concurrency import run_in_threadpool
 from pydantic import BaseModel, HttpUrl
 import uvicorn
+import aiofiles
 
 from app.cors import setup_cors
+from app.task_store import TaskStore
+from app.result_cache import ResultCache
 from app.youtube_downloader import YouTubeDownloader
 from app.audio_processor import AudioProcessor
 from app.music_transcriber import MusicTranscriber
 from app.melody_extractor import MelodyExtractor
 from app.sheet_music_generator import SheetMusicGenerator
+from app.workers import PipelineWorker
 
 # Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-)
+LOG_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+logging.basicConfig(level=logging.INFO, format=LOG_FORMAT)
 logger = logging.getLogger(__name__)
 
+# Create a directory for storing files
+UPLOAD_DIR = os.path.join(tempfile.gettempdir(), "piano-chorus-creator")
+os.makedirs(UPLOAD_DIR, exist_ok=True)
+
+# Chunk size used when streaming uploads to disk
+UPLOAD_CHUNK_SIZE = 1 << 20  # 1 MiB
+
+# Chunk size used when streaming downloads to the client
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+
+# Bounded in-memory task storage
+task_store = TaskStore()
+
+# On-disk cache of generated artifacts, keyed by content hash
+result_cache = ResultCache(cache_dir=os.path.join(UPLOAD_DIR, "cache"))
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    Create the processing components when the application starts and
+    stop the worker pools when it shuts down.
+    
+    Args:
+        app: FastAPI application instance
+    """
+    max_workers = int(os.environ.get("PIPELINE_WORKERS", 2))
+    
+    # Each task thread waits on at most one stage at a time, so both pools
+    # share the same size. Processes are spawned rather than forked because
+    # the API process already runs threads, and start with the same logging
+    # configuration since the component modules do not configure logging.
+    executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="pipeline")
+    stage_executor = ProcessPoolExecutor(
+        max_workers=max_workers,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=partial(logging.basicConfig, level=logging.INFO, format=LOG_FORMAT)
+    )
+    
+    # Initialize components
+    app.state.pipeline_worker = PipelineWorker(
+        task_store,
+        result_cache,
+        YouTubeDownloader(output_dir=UPLOAD_DIR),
+        AudioProcessor(output_dir=UPLOAD_DIR),
+        MusicTranscriber(output_dir=UPLOAD_DIR),
+        MelodyExtractor(output_dir=UPLOAD_DIR),
+        SheetMusicGenerator(output_dir=UPLOAD_DIR),
+        executor,
+        stage_executor
+    )
+    
+    yield
+    
+    app.state.pipeline_worker.shutdown(wait=False)
+
 # Create FastAPI app
 app = FastAPI(
     title="Piano Chorus Creator API",
     description="API for generating piano sheet music from YouTube links or audio files",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan,
+    default_response_class=ORJSONResponse
 )
 
 # Setup CORS for frontend integration
 setup_cors(app)
 
-# Create a directory for storing files
-UPLOAD_DIR = os.path.join(tempfile.gettempdir(), "piano-chorus-creator")
-os.makedirs(UPLOAD_DIR, exist_ok=True)
-
-# Initialize components
-youtube_downloader = YouTubeDownloader(output_dir=UPLOAD_DIR)
-audio_processor = AudioProcessor(output_dir=UPLOAD_DIR)
-music_transcriber = MusicTranscriber(output_dir=UPLOAD_DIR)
-melody_extractor = MelodyExtractor(output_dir=UPLOAD_DIR)
-sheet_music_generator = SheetMusicGenerator(output_dir=UPLOAD_DIR)
-
-# In-memory task storage
-tasks = {}
-
 # Models
 class YouTubeRequest(BaseModel):
     url: HttpUrl
@@ -73,144 +122,47 @@ class TaskStatusResponse(BaseModel):
     download_url: Optional[str] = None
 
 # Helper functions
-def process_youtube_task(task_id: str, url: str, title: Optional[str] = None):
+def new_task_id() -> str:
     """
-    Process a YouTube URL to generate sheet music.
+    Create a time-ordered (UUIDv7) task identifier.
     
-    Args:
-        task_id: Unique task identifier
-        url: YouTube URL
-        title: Optional title for the sheet music
+    Task ids prefix every file name in the upload directory, so ordering them
+    by creation time keeps new directory entries together.
+    
+    Returns:
+        Task identifier string
     """
-    try:
-        tasks[task_id]["status"] = "downloading"
-        tasks[task_id]["progress"] = 10
-        
-        # Download audio from YouTube
-        success, audio_path, download_info = youtube_downloader.download_audio(url, task_id)
-        if not success:
-            tasks[task_id]["status"] = "failed"
-            tasks[task_id]["message"] = f"Failed to download audio: {download_info.get('error', 'Unknown error')}"
-            return
-        
-        # Use video title if no title provided
-        if not title:
-            title = download_info.get("title", "Piano Arrangement")
-        
-        tasks[task_id]["progress"] = 30
-        tasks[task_id]["status"] = "processing"
-        
-        # Process the audio
-        success, processed_audio_path, process_info = audio_processor.process_audio(audio_path, task_id)
-        if not success:
-            tasks[task_id]["status"] = "failed"
-            tasks[task_id]["message"] = f"Failed to process audio: {process_info.get('error', 'Unknown error')}"
-            return
-        
-        tasks[task_id]["progress"] = 50
-        tasks[task_id]["status"] = "transcribing"
-        
-        # Transcribe the audio to MIDI
-        success, midi_info, midi_path = music_transcriber.transcribe_audio(processed_audio_path, task_id)
-        if not success:
-            tasks[task_id]["status"] = "failed"
-            tasks[task_id]["message"] = f"Failed to transcribe audio: {midi_info.get('error', 'Unknown error')}"
-            return
-        
-        tasks[task_id]["progress"] = 70
-        tasks[task_id]["status"] = "extracting_melody"
-        
-        # Extract the main melody with accompaniment
-        success, arrangement_info, arrangement_midi_path = melody_extractor.extract_with_accompaniment(midi_path, task_id)
-        if not success:
-            tasks[task_id]["status"] = "failed"
-            tasks[task_id]["message"] = f"Failed to extract melody: {arrangement_info.get('error', 'Unknown error')}"
-            return
-        
-        tasks[task_id]["progress"] = 85
-        tasks[task_id]["status"] = "generating_sheet_music"
-        
-        # Generate sheet music
-        success, sheet_info, pdf_path = sheet_music_generator.generate_sheet_music(arrangement_midi_path, task_id, title)
-        if not success:
-            tasks[task_id]["status"] = "failed"
-            tasks[task_id]["message"] = f"Failed to generate sheet music: {sheet_info.get('error', 'Unknown error')}"
-            return
-        
-        tasks[task_id]["progress"] = 100
-        tasks[task_id]["status"] = "completed"
-        tasks[task_id]["message"] = "Sheet music generated successfully"
-        tasks[task_id]["pdf_path"] = pdf_path
-        tasks[task_id]["download_url"] = f"/api/download/{task_id}"
-        
-    except Exception as e:
-        logger.error(f"Error processing YouTube task: {str(e)}")
-        tasks[task_id]["status"] = "failed"
-        tasks[task_id]["message"] = f"An unexpected error occurred: {str(e)}"
+    timestamp_ms = time.time_ns() // 1_000_000
+    value = (timestamp_ms & ((1 << 48) - 1)) << 80 | int.from_bytes(os.urandom(10), "big")
+    value = (value & ~(0xF << 76)) | (0x7 << 76)  # Version 7
+    value = (value & ~(0x3 << 62)) | (0x2 << 62)  # RFC 4122 variant
+    return str(uuid.UUID(int=value))
 
-def process_audio_task(task_id: str, audio_path: str, title: Optional[str] = None):
+def get_pipeline_worker(request: Request) -> PipelineWorker:
     """
-    Process an audio file to generate sheet music.
+    Get the pipeline worker created during application startup.
     
     Args:
-        task_id: Unique task identifier
-        audio_path: Path to the audio file
-        title: Optional title for the sheet music
-    """
-    try:
-        tasks[task_id]["status"] = "processing"
-        tasks[task_id]["progress"] = 20
-        
-        # Process the audio
-        success, processed_audio_path, process_info = audio_processor.process_audio(audio_path, task_id)
-        if not success:
-            tasks[task_id]["status"] = "failed"
-            tasks[task_id]["message"] = f"Failed to process audio: {process_info.get('error', 'Unknown error')}"
-            return
-        
-        tasks[task_id]["progress"] = 40
-        tasks[task_id]["status"] = "transcribing"
-        
-        # Transcribe the audio to MIDI
-        success, midi_info, midi_path = music_transcriber.transcribe_audio(processed_audio_path, task_id)
-        if not success:
-            tasks[task_id]["status"] = "failed"
-            tasks[task_id]["message"] = f"Failed to transcribe audio: {midi_info.get('error', 'Unknown error')}"
-            return
-        
-        tasks[task_id]["progress"] = 60
-        tasks[task_id]["status"] = "extracting_melody"
-        
-        # Extract the main melody with accompaniment
-        success, arrangement_info, arrangement_midi_path = melody_extractor.extract_with_accompaniment(midi_path, task_id)
-        if not success:
-            tasks[task_id]["status"] = "failed"
-            tasks[task_id]["message"] = f"Failed to extract melody: {arrangement_info.get('error', 'Unknown error')}"
-            return
-        
-        tasks[task_id]["progress"] = 80
-        tasks[task_id]["status"] = "generating_sheet_music"
-        
-        # Generate sheet music
-        if not title:
-            title = "Piano Arrangement"
-            
-        success, sheet_info, pdf_path = sheet_music_generator.generate_sheet_music(arrangement_midi_path, task_id, title)
-        if not success:
-            tasks[task_id]["status"] = "failed"
-            tasks[task_id]["message"] = f"Failed to generate sheet music: {sheet_info.get('error', 'Unknown error')}"
-            return
+        request: Incoming request
         
-        tasks[task_id]["progress"] = 100
-        tasks[task_id]["status"] = "completed"
-        tasks[task_id]["message"] = "Sheet music generated successfully"
-        tasks[task_id]["pdf_path"] = pdf_path
-        tasks[task_id]["download_url"] = f"/api/download/{task_id}"
+    Returns:
+        Pipeline worker instance
+    """
+    return request.app.state.pipeline_worker
+
+async def iter_file(file_path: str):
+    """
+    Read a file asynchronously in fixed-size chunks.
+    
+    Args:
+        file_path: Path to the file
         
-    except Exception as e:
-        logger.error(f"Error processing audio task: {str(e)}")
-        tasks[task_id]["status"] = "failed"
-        tasks[task_id]["message"] = f"An unexpected error occurred: {str(e)}"
+    Yields:
+        Chunks of the file contents
+    """
+    async with aiofiles.open(file_path, "rb") as f:
+        while chunk := await f.read(DOWNLOAD_CHUNK_SIZE):
+            yield chunk
 
 def cleanup_task_files(task_id: str):
     """
@@ -220,12 +172,26 @@ def cleanup_task_files(task_id: str):
         task_id: Task identifier
     """
     try:
-        # Keep the PDF file but remove other temporary files
-        for filename in os.listdir(UPLOAD_DIR):
-            if task_id in filename and not filename.endswith(".pdf"):
-                file_path = os.path.join(UPLOAD_DIR, filename)
-                if os.path.isfile(file_path):
-                    os.remove(file_path)
+        task = task_store.get(task_id)
+        if task is None:
+            # The task's file list is gone, so fall back to matching the
+            # task id prefix used by every file name in the upload directory
+            with os.scandir(UPLOAD_DIR) as entries:
+                for entry in entries:
+                    if (entry.name.startswith(task_id) and not entry.name.endswith(".pdf")
+                            and entry.is_file(follow_symlinks=False)):
+                        os.unlink(entry.path)
+            return
+        
+        # Keep the PDF file but remove the other files recorded for the task
+        for file_path in task.get("files", []):
+            if file_path.endswith(".pdf"):
+                continue
+            try:
+                os.remove(file_path)
+            except FileNotFoundError:
+                pass
+        task_store.update(task_id, files=[])
     except Exception as e:
         logger.error(f"Error cleaning up task files: {str(e)}")
 
@@ -236,102 +202,127 @@ async def root():
     return {"message": "Piano Chorus Creator API is running"}
 
 @app.post("/api/youtube", response_model=TaskResponse)
-async def process_youtube(request: YouTubeRequest, background_tasks: BackgroundTasks):
+async def process_youtube(request: YouTubeRequest, pipeline_worker: PipelineWorker = Depends(get_pipeline_worker)):
     """
     Process a YouTube URL to generate piano sheet music.
     
     Args:
         request: YouTube request containing URL and optional title
-        background_tasks: FastAPI background tasks
+        pipeline_worker: Worker that runs the processing pipeline
         
     Returns:
         Task response with task ID and status
     """
     # Validate YouTube URL
-    if not youtube_downloader.validate_url(request.url):
+    if not pipeline_worker.youtube_downloader.validate_url(str(request.url)):
         raise HTTPException(status_code=400, detail="Invalid YouTube URL")
     
     # Create a new task
-    task_id = str(uuid.uuid4())
-    tasks[task_id] = {
-        "status": "queued",
-        "progress": 0,
-        "message": "Task queued for processing"
-    }
+    task_id = new_task_id()
+    task_store.update(
+        task_id,
+        status="queued",
+        progress=0,
+        message="Task queued for processing"
+    )
     
-    # Process the task in the background
-    background_tasks.add_task(process_youtube_task, task_id, str(request.url), request.title)
+    # Process the task on the worker pool
+    pipeline_worker.submit(pipeline_worker.process_youtube_task, task_id, str(request.url), request.title)
     
     return TaskResponse(task_id=task_id, status="queued")
 
 @app.post("/api/audio", response_model=TaskResponse)
 async def process_audio(
-    background_tasks: BackgroundTasks,
     file: UploadFile = File(...),
-    title: Optional[str] = Form(None)
+    title: Optional[str] = Form(None),
+    pipeline_worker: PipelineWorker = Depends(get_pipeline_worker)
 ):
     """
     Process an audio file to generate piano sheet music.
     
     Args:
-        background_tasks: FastAPI background tasks
         file: Uploaded audio file
         title: Optional title for the sheet music
+        pipeline_worker: Worker that runs the processing pipeline
         
     Returns:
         Task response with task ID and status
     """
+    # Reject unsupported formats before anything is written to disk
+    file_ext = os.path.splitext(file.filename or "")[1].lower()
+    if file_ext not in pipeline_worker.audio_processor.supported_formats:
+        raise HTTPException(status_code=400, detail="Invalid audio file format")
+    
     # Create a new task
-    task_id = str(uuid.uuid4())
-    tasks[task_id] = {
-        "status": "uploading",
-        "progress": 0,
-        "message": "Uploading audio file"
-    }
+    task_id = new_task_id()
+    task_store.update(
+        task_id,
+        status="uploading",
+        progress=0,
+        message="Uploading audio file"
+    )
     
     # Save the uploaded file
-    file_path = os.path.join(UPLOAD_DIR, f"{task_id}_original{os.path.splitext(file.filename)[1]}")
+    file_path = os.path.join(UPLOAD_DIR, f"{task_id}_original{file_ext}")
     
     try:
-        with open(file_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
+        # Stream the upload in chunks so the event loop stays responsive,
+        # hashing it on the way so identical uploads can be served from cache
+        hasher = result_cache.hasher()
+        async with aiofiles.open(file_path, "wb") as buffer:
+            while chunk := await file.read(UPLOAD_CHUNK_SIZE):
+                hasher.update(chunk)
+                await buffer.write(chunk)
     except Exception as e:
         logger.error(f"Error saving uploaded file: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Error saving uploaded file: {str(e)}")
-    finally:
-        file.file.close()
     
-    # Validate audio file
-    if not audio_processor.is_valid_audio_file(file_path):
+    task_store.add_files(task_id, file_path)
+    
+    # Validate the audio header, since the extension alone proves nothing
+    if not pipeline_worker.audio_processor.is_valid_audio_file(file_path):
         os.remove(file_path)
         raise HTTPException(status_code=400, detail="Invalid audio file format")
     
-    tasks[task_id]["status"] = "queued"
-    tasks[task_id]["progress"] = 10
-    tasks[task_id]["message"] = "Task queued for processing"
+    # Reuse the sheet music of an identical earlier upload
+    upload_key = result_cache.make_key("upload", hasher.hexdigest(), title or "")
+    if await run_in_threadpool(pipeline_worker.complete_from_cache, task_id, upload_key):
+        return TaskResponse(task_id=task_id, status="completed")
+    
+    task_store.update(task_id, status="queued", progress=10, message="Task queued for processing")
     
-    # Process the task in the background
-    background_tasks.add_task(process_audio_task, task_id, file_path, title)
+    # Process the task on the worker pool
+    pipeline_worker.submit(pipeline_worker.process_audio_task, task_id, file_path, title, upload_key)
     
     return TaskResponse(task_id=task_id, status="queued")
 
 @app.get("/api/status/{task_id}", response_model=TaskStatusResponse)
-async def get_task_status(task_id: str):
+async def get_task_status(task_id: str, request: Request, response: Response):
     """
     Get the status of a task.
     
+    Clients polling the endpoint can send the last ETag in If-None-Match
+    and receive an empty 304 response while the task has not changed.
+    
     Args:
         task_id: Task identifier
+        request: Incoming request
+        response: Response whose headers are set
         
     Returns:
         Task status response
     """
-    if task_id not in tasks:
+    task = task_store.get(task_id)
+    if task is None:
         raise HTTPException(status_code=404, detail="Task not found")
     
-    task = tasks[task_id]
+    etag = f'W/"{task["status"]}-{task.get("progress", 0)}"'
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
+    response.headers.update(headers)
     
-    response = TaskStatusResponse(
+    status_response = TaskStatusResponse(
         task_id=task_id,
         status=task["status"],
         progress=task.get("progress"),
@@ -339,9 +330,9 @@ async def get_task_status(task_id: str):
     )
     
     if task["status"] == "completed":
-        response.download_url = task["download_url"]
+        status_response.download_url = task["download_url"]
     
-    return response
+    return status_response
 
 @app.get("/api/download/{task_id}")
 async def download_sheet_music(task_id: str, background_tasks: BackgroundTasks):
@@ -355,11 +346,10 @@ async def download_sheet_music(task_id: str, background_tasks: BackgroundTasks):
     Returns:
         PDF file response
     """
-    if task_id not in tasks:
+    task = task_store.get(task_id)
+    if task is None:
         raise HTTPException(status_code=404, detail="Task not found")
     
-    task = tasks[task_id]
-    
     if task["status"] != "completed":
         raise HTTPException(status_code=400, detail="Sheet music not ready yet")
     
@@ -368,16 +358,21 @@ async def download_sheet_music(task_id: str, background_tasks: BackgroundTasks):
     
     pdf_path = task["pdf_path"]
     
-    if not os.path.exists(pdf_path):
+    try:
+        pdf_size = os.stat(pdf_path).st_size
+    except FileNotFoundError:
         raise HTTPException(status_code=404, detail="PDF file not found")
     
     # Schedule cleanup of task files (except the PDF)
     background_tasks.add_task(cleanup_task_files, task_id)
     
-    return FileResponse(
-        path=pdf_path,
-        filename=f"piano_arrangement_{task_id}.pdf",
-        media_type="application/pdf"
+    return StreamingResponse(
+        iter_file(pdf_path),
+        media_type="application/pdf",
+        headers={
+            "Content-Disposition": f'attachment; filename="piano_arrangement_{task_id}.pdf"',
+            "Content-Length": str(pdf_size)
+        }
     )
 
 # Run the application
@@ -9,36 +9,65 @@ import os
 import logging
 import tempfile
 from typing import Dict, Optional, Tuple
-import librosa
+import audioread
 import numpy as np
 import soundfile as sf
+from numba import njit, prange
 
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-)
 logger = logging.getLogger(__name__)
 
+# Sample rate expected by the Basic Pitch transcription model
+TARGET_SAMPLE_RATE = 22050
+
+# Compiled at import time for the one array type it is called with
+@njit("float32(float32[::1])", parallel=True, fastmath=True, cache=True)
+def _normalize_inplace(y: np.ndarray) -> float:
+    """
+    Peak-normalize a mono signal in place.
+    
+    Args:
+        y: Mono float32 audio signal
+        
+    Returns:
+        Peak amplitude of the signal before normalization
+    """
+    # Parallel max reduction, then a parallel in-place scale
+    peak = np.float32(0.0)
+    for i in prange(y.shape[0]):
+        peak = max(peak, abs(y[i]))
+    
+    if peak > 0:
+        scale = np.float32(1.0) / peak
+        for i in prange(y.shape[0]):
+            y[i] *= scale
+    
+    return peak
+
 class AudioProcessor:
     """
     Class for processing audio files for melody extraction.
     """
     
-    def __init__(self, output_dir: Optional[str] = None):
+    def __init__(self, output_dir: Optional[str] = None, target_sr: Optional[int] = TARGET_SAMPLE_RATE):
         """
         Initialize the audio processor.
         
         Args:
             output_dir: Directory to save processed audio files.
                         If None, a temporary directory will be used.
+            target_sr: Sample rate audio is resampled to when loaded.
+                       If None, the native sample rate is kept.
         """
         self.output_dir = output_dir or tempfile.mkdtemp()
+        self.target_sr = target_sr
         os.makedirs(self.output_dir, exist_ok=True)
         logger.info(f"Audio processor initialized with output directory: {self.output_dir}")
         
         # Supported audio formats
         self.supported_formats = ['.mp3', '.wav', '.ogg', '.flac', '.m4a']
+        
+        # Formats libsndfile decodes natively; the rest go through librosa/audioread
+        self.soundfile_formats = ['.wav', '.ogg', '.flac']
     
     def is_valid_audio_file(self, file_path: str) -> bool:
         """
@@ -60,8 +89,12 @@ class AudioProcessor:
             return False
             
         try:
-            # Try to load a small portion of the file to verify it's valid
-            y, sr = librosa.load(file_path, sr=None, duration=1.0)
+            # Read only the header; no audio frames are decoded
+            if file_ext in self.soundfile_formats:
+                return sf.info(file_path).frames > 0
+            
+            with audioread.audio_open(file_path):
+                pass
             return True
         except Exception as e:
             logger.error(f"Error loading audio file: {str(e)}")
@@ -81,25 +114,24 @@ class AudioProcessor:
                 - Path to processed audio file (str)
                 - Additional info about the processing (Dict)
         """
-        if not self.is_valid_audio_file(file_path):
-            return False, "", {"error": "Invalid audio file"}
-        
         output_file = os.path.join(self.output_dir, f"{task_id}_processed.wav")
         
         try:
             logger.info(f"Processing audio file: {file_path}")
             
-            # Load audio file
-            y, sr = librosa.load(file_path, sr=None)
+            # Load audio file as mono float32
+            y, sr = self._load_audio(file_path)
             
             # Get audio duration
-            duration = librosa.get_duration(y=y, sr=sr)
+            duration = len(y) / sr
             
-            # Normalize audio
-            y_normalized = librosa.util.normalize(y)
+            # Normalize audio in place to avoid a second full-size buffer
+            y = np.ascontiguousarray(y, dtype=np.float32)
+            _normalize_inplace(y)
             
-            # Save processed audio
-            sf.write(output_file, y_normalized, sr)
+            # Save processed audio as 16-bit PCM; the transcriber decodes it
+            # back to float anyway, so extra precision would only add bandwidth
+            sf.write(output_file, y, sr, subtype='PCM_16')
             
             logger.info(f"Successfully processed audio to {output_file}")
             return True, output_file, {
@@ -112,6 +144,33 @@ class AudioProcessor:
             logger.error(f"Error processing audio file: {str(e)}")
             return False, "", {"error": str(e)}
     
+    def _load_audio(self, file_path: str) -> Tuple[np.ndarray, int]:
+        """
+        Decode an audio file into a mono float32 signal at the target sample rate.
+        
+        Args:
+            file_path: Path to the audio file
+            
+        Returns:
+            Tuple containing the audio signal and its sample rate
+        """
+        file_ext = os.path.splitext(file_path)[1].lower()
+        if file_ext not in self.soundfile_formats:
+            import librosa
+            return librosa.load(file_path, sr=self.target_sr)
+        
+        y, sr = sf.read(file_path, dtype='float32', always_2d=False)
+        if y.ndim > 1:
+            # Downmix to mono, matching librosa.load's default behaviour
+            y = y.mean(axis=1, dtype=np.float32)
+        
+        # Resample once here so every later stage works on the shorter signal
+        if self.target_sr and sr != self.target_sr:
+            import librosa
+            y = librosa.resample(y, orig_sr=sr, target_sr=self.target_sr)
+            sr = self.target_sr
+        return y, sr
+    
     def extract_features(self, file_path: str) -> Dict:
         """
         Extract audio features for melody analysis.
@@ -126,27 +185,37 @@ class AudioProcessor:
             return {"error": "Invalid audio file"}
         
         try:
+            # librosa is slow to import, so only load it when features are needed
+            import librosa
+            
             # Load audio file
-            y, sr = librosa.load(file_path, sr=None)
+            y, sr = self._load_audio(file_path)
+            
+            # Compute the STFT once and share it between all features
+            stft = librosa.stft(y)
+            magnitude = np.abs(stft)
+            mel_db = librosa.power_to_db(librosa.feature.melspectrogram(S=magnitude ** 2, sr=sr))
             
             # Extract features
             # Spectral features
-            spectral_centroid = librosa.feature.spectral_centroid(y=y, sr=sr)[0]
-            spectral_bandwidth = librosa.feature.spectral_bandwidth(y=y, sr=sr)[0]
-            spectral_rolloff = librosa.feature.spectral_rolloff(y=y, sr=sr)[0]
+            spectral_centroid = librosa.feature.spectral_centroid(S=magnitude, sr=sr)[0]
+            spectral_bandwidth = librosa.feature.spectral_bandwidth(S=magnitude, sr=sr)[0]
+            spectral_rolloff = librosa.feature.spectral_rolloff(S=magnitude, sr=sr)[0]
             
             # Rhythmic features
-            tempo, _ = librosa.beat.beat_track(y=y, sr=sr)
+            onset_envelope = librosa.onset.onset_strength(S=mel_db, sr=sr)
+            tempo, _ = librosa.beat.beat_track(onset_envelope=onset_envelope, sr=sr)
             
             # Harmonic features
-            harmonic, percussive = librosa.effects.hpss(y)
+            harmonic_stft, _ = librosa.decompose.hpss(stft)
+            harmonic = librosa.istft(harmonic_stft, length=len(y))
             chroma = librosa.feature.chroma_cqt(y=harmonic, sr=sr)
             
             # MFCC features
-            mfccs = librosa.feature.mfcc(y=y, sr=sr, n_mfcc=13)
+            mfccs = librosa.feature.mfcc(S=mel_db, n_mfcc=13)
             
             return {
-                "duration": librosa.get_duration(y=y, sr=sr),
+                "duration": len(y) / sr,
                 "sample_rate": sr,
                 "tempo": tempo,
                 "spectral_centroid_mean": np.mean(spectral_centroid),
@@ -164,6 +233,11 @@ class AudioProcessor:
 # Example usage
 if __name__ == "__main__":
     # This code will only run if the file is executed directly
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    )
+    
     processor = AudioProcessor()
     
     # Example with a test file
@@ -4,29 +4,35 @@ CORS Configuration Module for Piano Chorus Creator Backend
 This module provides CORS configuration for the frontend integration.
 """
 
+import os
 from fastapi.middleware.cors import CORSMiddleware
 
 def setup_cors(app):
     """
     Configure CORS for the FastAPI application.
     
+    Only the known frontend origins are allowed, so responses do not need
+    per-request origin handling. Set CORS_ALLOW_ALL=1 to allow any origin
+    for testing; credentials are disabled in that mode.
+    
     Args:
         app: FastAPI application instance
     """
     # Frontend URL
     frontend_url = "https://piano-chorus-creator.lovable.app"
     
+    allow_all = os.environ.get("CORS_ALLOW_ALL", "").lower() in ("1", "true", "yes")
+    
     # Configure CORS
     app.add_middleware(
         CORSMiddleware,
-        allow_origins=[
+        allow_origins=["*"] if allow_all else [
             frontend_url,
             "http://localhost:3000",  # For local development
-            "*"  # Allow all origins temporarily for testing
         ],
-        allow_credentials=True,
-        allow_methods=["*"],  # Allow all methods
-        allow_headers=["*"],  # Allow all headers
+        allow_credentials=not allow_all,
+        allow_methods=["GET", "POST"],
+        allow_headers=["Content-Type", "Authorization"],
     )
     
     return app
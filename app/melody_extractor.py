@@ -11,15 +11,92 @@ import tempfile
 from typing import Dict, Optional, Tuple, List
 import numpy as np
 import pretty_midi
-from collections import Counter, defaultdict
+from numba import njit, prange
 
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-)
 logger = logging.getLogger(__name__)
 
+# Record layout used to load note attributes in a single pass
+NOTE_DTYPE = np.dtype([("start", np.float64), ("end", np.float64), ("pitch", np.int64), ("velocity", np.int64)])
+
+def _notes_to_soa(notes: List[pretty_midi.Note]) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Load note attributes into one array per attribute.
+    
+    Args:
+        notes: List of MIDI notes
+        
+    Returns:
+        Tuple containing the start times, end times, pitches and velocities
+    """
+    records = np.fromiter(
+        ((note.start, note.end, note.pitch, note.velocity) for note in notes),
+        dtype=NOTE_DTYPE, count=len(notes)
+    )
+    return records["start"], records["end"], records["pitch"], records["velocity"]
+
+# 64-bit FNV-1a parameters used to fingerprint segments
+FNV_OFFSET_BASIS = np.uint64(14695981039346656037)
+FNV_PRIME = np.uint64(1099511628211)
+
+# Kernels are declared with explicit signatures so they are compiled (or loaded
+# from the on-disk cache) at import time rather than on the first request
+@njit("Tuple((uint64[::1], int32[::1]))(int64[::1], int64[::1], int64)", cache=True)
+def _segment_hashes(note_segments: np.ndarray, pitches: np.ndarray, num_segments: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Fingerprint fixed-length segments by hashing their pitch differences.
+    
+    Args:
+        note_segments: Segment index of every note, with notes sorted by start time
+        pitches: Note pitches in the same order
+        num_segments: Number of segments
+        
+    Returns:
+        Tuple containing the hash and the note count of every segment
+    """
+    segment_hashes = np.zeros(num_segments, np.uint64)
+    segment_counts = np.zeros(num_segments, np.int32)
+    last_pitches = np.zeros(num_segments, np.int64)
+    
+    for i in range(note_segments.shape[0]):
+        segment_idx = note_segments[i]
+        if segment_idx >= num_segments:
+            continue
+        
+        # FNV-1a over the pitch differences within the segment, one byte each
+        if segment_counts[segment_idx] == 0:
+            segment_hashes[segment_idx] = FNV_OFFSET_BASIS
+        else:
+            pitch_diff = np.uint64((pitches[i] - last_pitches[segment_idx]) & 0xFF)
+            segment_hashes[segment_idx] = (segment_hashes[segment_idx] ^ pitch_diff) * FNV_PRIME
+        last_pitches[segment_idx] = pitches[i]
+        segment_counts[segment_idx] += 1
+    
+    return segment_hashes, segment_counts
+
+@njit("float64[::1](int64[::1], int64[::1])", parallel=True, cache=True)
+def _score_instruments(pitches: np.ndarray, offsets: np.ndarray) -> np.ndarray:
+    """
+    Score instruments by how likely they are to carry the melody.
+    
+    Args:
+        pitches: Pitches of all instruments' notes, concatenated
+        offsets: Start of each instrument's notes in pitches, followed by the total count
+        
+    Returns:
+        Score of every instrument
+    """
+    scores = np.zeros(offsets.shape[0] - 1, np.float64)
+    for i in prange(offsets.shape[0] - 1):
+        start, end = offsets[i], offsets[i + 1]
+        total = 0
+        for k in range(start, end):
+            total += pitches[k]
+        
+        # Higher pitches and more notes are more likely to be the melody
+        scores[i] = (end - start) * (total / (end - start) / 127.0)
+    
+    return scores
+
 class MelodyExtractor:
     """
     Class for extracting the main melody or chorus from transcribed music.
@@ -63,74 +140,13 @@ class MelodyExtractor:
             # Load the MIDI file
             midi_data = pretty_midi.PrettyMIDI(midi_path)
             
-            # Find the instrument with the most notes in the highest pitch range
-            # This is a simple heuristic for finding the melody
-            best_instrument = None
-            highest_score = -1
-            
-            for instrument in midi_data.instruments:
-                if instrument.is_drum:
-                    continue
-                
-                if not instrument.notes:
-                    continue
-                
-                # Calculate the average pitch
-                pitches = [note.pitch for note in instrument.notes]
-                avg_pitch = sum(pitches) / len(pitches)
-                
-                # Calculate a score based on number of notes and average pitch
-                # Higher pitches and more notes are more likely to be the melody
-                score = len(instrument.notes) * (avg_pitch / 127.0)
-                
-                if score > highest_score:
-                    highest_score = score
-                    best_instrument = instrument
-            
-            if best_instrument is None:
-                logger.error("No suitable melody instrument found in MIDI")
-                return False, {"error": "No suitable melody instrument found"}, ""
-            
-            # Create a new MIDI file with just the melody
-            melody_midi = pretty_midi.PrettyMIDI()
-            
-            # Copy tempo and time signature information
-            for tempo_change in midi_data.get_tempo_changes()[1]:
-                melody_midi._tick_scales.append((0, 60.0 / tempo_change))
-            
-            for ts in midi_data.time_signature_changes:
-                melody_midi.time_signature_changes.append(ts)
-            
-            for ks in midi_data.key_signature_changes:
-                melody_midi.key_signature_changes.append(ks)
-            
-            # Create a new instrument for the melody
-            melody_instrument = pretty_midi.Instrument(
-                program=best_instrument.program,
-                name="Melody"
-            )
-            
-            # Find the chorus/main part by identifying repeated patterns
-            chorus_notes = self._identify_chorus(best_instrument.notes)
-            
-            # Add the chorus notes to the melody instrument
-            for note in chorus_notes:
-                melody_instrument.notes.append(note)
-            
-            melody_midi.instruments.append(melody_instrument)
+            success, melody_info, melody_midi = self._extract_main_melody_from_midi(midi_data)
+            if not success:
+                return False, melody_info, ""
             
             # Save the melody MIDI
             melody_midi.write(melody_midi_path)
             
-            # Extract basic information
-            melody_info = {
-                "original_instrument": best_instrument.name or "Unknown",
-                "program": best_instrument.program,
-                "total_notes": len(best_instrument.notes),
-                "chorus_notes": len(chorus_notes),
-                "duration": melody_midi.get_end_time()
-            }
-            
             logger.info(f"Successfully extracted melody to MIDI: {melody_midi_path}")
             return True, melody_info, melody_midi_path
                 
@@ -138,12 +154,101 @@ class MelodyExtractor:
             logger.error(f"Error extracting melody: {str(e)}")
             return False, {"error": str(e)}, ""
     
-    def _identify_chorus(self, notes: List[pretty_midi.Note]) -> List[pretty_midi.Note]:
+    def _extract_main_melody_from_midi(self, midi_data: pretty_midi.PrettyMIDI) -> Tuple[bool, Dict, Optional[pretty_midi.PrettyMIDI]]:
+        """
+        Extract the main melody from loaded MIDI data.
+        
+        Args:
+            midi_data: PrettyMIDI object to extract the melody from
+            
+        Returns:
+            Tuple containing:
+                - Success status (bool)
+                - Dictionary of melody data
+                - PrettyMIDI object holding the melody
+        """
+        # Find the instrument with the most notes in the highest pitch range
+        # This is a simple heuristic for finding the melody
+        candidates = [
+            instrument for instrument in midi_data.instruments
+            if not instrument.is_drum and instrument.notes
+        ]
+        
+        best_instrument = None
+        if len(candidates) == 1:
+            # Basic Pitch output has a single instrument, so there is nothing to score
+            best_instrument = candidates[0]
+        elif candidates:
+            # Score all instruments at once from their concatenated pitches
+            offsets = np.zeros(len(candidates) + 1, dtype=np.int64)
+            np.cumsum([len(instrument.notes) for instrument in candidates], out=offsets[1:])
+            pitches = np.fromiter(
+                (note.pitch for instrument in candidates for note in instrument.notes),
+                dtype=np.int64, count=offsets[-1]
+            )
+            best_instrument = candidates[int(_score_instruments(pitches, offsets).argmax())]
+        
+        if best_instrument is None:
+            logger.error("No suitable melody instrument found in MIDI")
+            return False, {"error": "No suitable melody instrument found"}, None
+        
+        # Create a new MIDI file with just the melody
+        melody_midi = self._create_midi_like(midi_data)
+        
+        # Create a new instrument for the melody
+        melody_instrument = pretty_midi.Instrument(
+            program=best_instrument.program,
+            name="Melody"
+        )
+        
+        # Find the chorus/main part by identifying repeated patterns
+        chorus_notes = self._identify_chorus(best_instrument.notes)
+        
+        # Add the chorus notes to the melody instrument
+        melody_instrument.notes.extend(chorus_notes)
+        
+        melody_midi.instruments.append(melody_instrument)
+        
+        # Extract basic information
+        melody_info = {
+            "original_instrument": best_instrument.name or "Unknown",
+            "program": best_instrument.program,
+            "total_notes": len(best_instrument.notes),
+            "chorus_notes": len(chorus_notes),
+            "duration": melody_midi.get_end_time()
+        }
+        
+        return True, melody_info, melody_midi
+    
+    def _create_midi_like(self, midi_data: pretty_midi.PrettyMIDI) -> pretty_midi.PrettyMIDI:
+        """
+        Create an empty MIDI file with the tempo, time signature and key
+        signature information of another.
+        
+        Args:
+            midi_data: PrettyMIDI object to copy the information from
+            
+        Returns:
+            New PrettyMIDI object without instruments
+        """
+        new_midi = pretty_midi.PrettyMIDI(resolution=midi_data.resolution)
+        
+        # Copy the tempo map as a whole. The tick scales are seconds per tick at
+        # their tick positions, so they only carry over at the same resolution.
+        new_midi._tick_scales = list(midi_data._tick_scales)
+        new_midi._update_tick_to_time(new_midi._tick_scales[-1][0])
+        
+        new_midi.time_signature_changes.extend(midi_data.time_signature_changes)
+        new_midi.key_signature_changes.extend(midi_data.key_signature_changes)
+        return new_midi
+    
+    def _identify_chorus(self, notes: List[pretty_midi.Note], duration: Optional[float] = None) -> List[pretty_midi.Note]:
         """
         Identify the chorus or main part of a song by finding repeated patterns.
         
         Args:
             notes: List of MIDI notes
+            duration: End time of the last note, if already known
             
         Returns:
             List of notes that are part of the chorus
@@ -152,60 +257,41 @@ class MelodyExtractor:
             return []
         
         # Sort notes by start time
-        sorted_notes = sorted(notes, key=lambda note: note.start)
+        starts, ends, pitches, _ = _notes_to_soa(notes)
+        order = np.argsort(starts, kind="stable")
         
         # Divide the song into segments
-        song_duration = max(note.end for note in notes)
+        song_duration = duration if duration is not None else ends.max()
         segment_duration = 4.0  # 4 seconds per segment
         num_segments = int(song_duration / segment_duration) + 1
         
-        # Create a representation of each segment
-        segments = [[] for _ in range(num_segments)]
-        for note in sorted_notes:
-            segment_idx = int(note.start / segment_duration)
-            if segment_idx < num_segments:
-                segments[segment_idx].append(note)
-        
-        # Create a fingerprint for each segment based on note patterns
-        segment_fingerprints = []
-        for segment in segments:
-            if not segment:
-                segment_fingerprints.append("")
-                continue
-                
-            # Create a simple fingerprint based on relative pitch changes
-            pitches = [note.pitch for note in sorted(segment, key=lambda n: n.start)]
-            if len(pitches) <= 1:
-                segment_fingerprints.append("")
-                continue
-                
-            # Calculate pitch differences
-            pitch_diffs = [pitches[i+1] - pitches[i] for i in range(len(pitches)-1)]
-            fingerprint = ",".join(map(str, pitch_diffs))
-            segment_fingerprints.append(fingerprint)
-        
-        # Count occurrences of each fingerprint
-        fingerprint_counts = Counter(segment_fingerprints)
-        
-        # Find the most common fingerprint (excluding empty ones)
-        most_common = None
-        max_count = 0
-        for fingerprint, count in fingerprint_counts.items():
-            if fingerprint and count > max_count:
-                most_common = fingerprint
-                max_count = count
-        
-        if not most_common:
+        # Create a fingerprint for each segment based on relative pitch changes;
+        # segments with fewer than two notes have no fingerprint
+        note_segments = (starts[order] * (1.0 / segment_duration)).astype(np.int64)
+        segment_hashes, segment_counts = _segment_hashes(note_segments, pitches[order], num_segments)
+        has_fingerprint = segment_counts > 1
+        if not has_fingerprint.any():
             # If no repeated patterns found, return all notes
             return notes
         
+        # Find the most common fingerprint from the run lengths of the sorted
+        # fingerprints. The sort is stable, so each run starts at the earliest
+        # segment with that fingerprint, which is preferred on ties.
+        fingerprints = segment_hashes[has_fingerprint]
+        fingerprint_order = np.argsort(fingerprints, kind="stable")
+        sorted_fingerprints = fingerprints[fingerprint_order]
+        run_starts = np.r_[0, np.nonzero(np.diff(sorted_fingerprints))[0] + 1]
+        counts = np.diff(np.r_[run_starts, fingerprints.size])
+        is_most_common = counts == counts.max()
+        most_common_run = run_starts[is_most_common][fingerprint_order[run_starts[is_most_common]].argmin()]
+        most_common = sorted_fingerprints[most_common_run]
+        
         # Find segments with the most common fingerprint
-        chorus_segments = [i for i, fp in enumerate(segment_fingerprints) if fp == most_common]
+        is_chorus_segment = has_fingerprint & (segment_hashes == most_common)
         
         # Collect notes from chorus segments
-        chorus_notes = []
-        for segment_idx in chorus_segments:
-            chorus_notes.extend(segments[segment_idx])
+        is_chorus_note = is_chorus_segment[np.minimum(note_segments, num_segments - 1)] & (note_segments < num_segments)
+        chorus_notes = [notes[i] for i in order[is_chorus_note]]
         
         # If we didn't find enough notes, return the original notes
         if len(chorus_notes) < len(notes) * 0.2:
@@ -239,30 +325,18 @@ class MelodyExtractor:
             # Load the MIDI file
             midi_data = pretty_midi.PrettyMIDI(midi_path)
             
-            # First extract the melody
-            success, melody_info, melody_midi_path = self.extract_main_melody(midi_path, task_id)
+            # First extract the melody from the already loaded MIDI data
+            success, melody_info, melody_midi = self._extract_main_melody_from_midi(midi_data)
             if not success:
                 return False, melody_info, ""
             
-            # Load the melody MIDI
-            melody_midi = pretty_midi.PrettyMIDI(melody_midi_path)
             if not melody_midi.instruments or not melody_midi.instruments[0].notes:
                 return False, {"error": "No melody notes found"}, ""
             
             melody_notes = melody_midi.instruments[0].notes
             
             # Create a new MIDI file for the arrangement
-            arrangement_midi = pretty_midi.PrettyMIDI()
-            
-            # Copy tempo and time signature information
-            for tempo_change in midi_data.get_tempo_changes()[1]:
-                arrangement_midi._tick_scales.append((0, 60.0 / tempo_change))
-            
-            for ts in midi_data.time_signature_changes:
-                arrangement_midi.time_signature_changes.append(ts)
-            
-            for ks in midi_data.key_signature_changes:
-                arrangement_midi.key_signature_changes.append(ks)
+            arrangement_midi = self._create_midi_like(midi_data)
             
             # Create a right hand (treble) instrument for the melody
             right_hand = pretty_midi.Instrument(
@@ -271,8 +345,7 @@ class MelodyExtractor:
             )
             
             # Add the melody notes to the right hand
-            for note in melody_notes:
-                right_hand.notes.append(note)
+            right_hand.notes.extend(melody_notes)
             
             # Create a left hand (bass) instrument for accompaniment
             left_hand = pretty_midi.Instrument(
@@ -281,11 +354,11 @@ class MelodyExtractor:
             )
             
             # Generate basic chord accompaniment based on the melody
-            accompaniment_notes = self._generate_accompaniment(melody_notes)
+            melody_duration = melody_info["duration"]
+            accompaniment_notes = self._generate_accompaniment(melody_notes, duration=melody_duration)
             
             # Add the accompaniment notes to the left hand
-            for note in accompaniment_notes:
-                left_hand.notes.append(note)
+            left_hand.notes.extend(accompaniment_notes)
             
             arrangement_midi.instruments.append(right_hand)
             arrangement_midi.instruments.append(left_hand)
@@ -297,7 +370,8 @@ class MelodyExtractor:
             arrangement_info = {
                 "melody_notes": len(melody_notes),
                 "accompaniment_notes": len(accompaniment_notes),
-                "duration": arrangement_midi.get_end_time()
+                # Chords fill whole measures, so they end no earlier than the melody
+                "duration": max(melody_duration, accompaniment_notes[-1].end) if accompaniment_notes else melody_duration
             }
             
             logger.info(f"Successfully created arrangement: {arrangement_midi_path}")
@@ -307,12 +381,13 @@ class MelodyExtractor:
             logger.error(f"Error creating arrangement: {str(e)}")
             return False, {"error": str(e)}, ""
     
-    def _generate_accompaniment(self, melody_notes: List[pretty_midi.Note]) -> List[pretty_midi.Note]:
+    def _generate_accompaniment(self, melody_notes: List[pretty_midi.Note], duration: Optional[float] = None) -> List[pretty_midi.Note]:
         """
         Generate basic chord accompaniment for a melody.
         
         Args:
             melody_notes: List of melody notes
+            duration: End time of the last melody note, if already known
             
         Returns:
             List of accompaniment notes
@@ -321,79 +396,85 @@ class MelodyExtractor:
             return []
         
         # Sort notes by start time
-        sorted_notes = sorted(melody_notes, key=lambda note: note.start)
+        starts, ends, pitches, _ = _notes_to_soa(melody_notes)
+        pitch_classes = (pitches % 12).astype(np.int8)  # Normalize to octave
+        order = np.argsort(starts, kind="stable")
+        starts, pitch_classes = starts[order], pitch_classes[order]
         
         # Determine the song duration
-        song_duration = max(note.end for note in sorted_notes)
+        song_duration = duration if duration is not None else ends.max()
         
         # Divide the song into measures (assuming 4/4 time signature)
         measure_duration = 2.0  # 2 seconds per measure (moderate tempo)
         num_measures = int(song_duration / measure_duration) + 1
         
-        # Group notes by measure
-        measures = [[] for _ in range(num_measures)]
-        for note in sorted_notes:
-            measure_idx = int(note.start / measure_duration)
-            if measure_idx < num_measures:
-                measures[measure_idx].append(note)
-        
-        # Generate chords for each measure
-        accompaniment_notes = []
-        for measure_idx, measure_notes in enumerate(measures):
-            if not measure_notes:
-                continue
-            
-            # Find the most common pitches in the measure
-            pitches = [note.pitch % 12 for note in measure_notes]  # Normalize to octave
-            pitch_counts = Counter(pitches)
-            
-            # Get the most common pitch as the root note
-            root_pitch = pitch_counts.most_common(1)[0][0] if pitch_counts else 0
-            
-            # Create a simple triad chord (root, third, fifth)
-            # Major chord: root, root+4, root+7
-            # Minor chord: root, root+3, root+7
-            
-            # Determine if major or minor based on the third most common in the melody
-            has_major_third = (root_pitch + 4) % 12 in pitches
-            has_minor_third = (root_pitch + 3) % 12 in pitches
-            
-            # Default to major if can't determine
-            is_major = True
-            if has_minor_third and not has_major_third:
-                is_major = False
-            
-            # Create the chord in a lower octave
-            base_octave = 4  # Middle C octave
-            root_note = root_pitch + (base_octave - 1) * 12  # One octave lower
-            
-            third_interval = 4 if is_major else 3
-            chord_pitches = [
-                root_note,  # Root
-                root_note + third_interval,  # Third
-                root_note + 7  # Fifth
-            ]
-            
-            # Add the chord notes
-            measure_start = measure_idx * measure_duration
-            measure_end = (measure_idx + 1) * measure_duration
-            
-            for pitch in chord_pitches:
-                # Create a whole note for the chord
-                chord_note = pretty_midi.Note(
-                    velocity=70,  # Slightly softer than melody
-                    pitch=pitch,
-                    start=measure_start,
-                    end=measure_end
-                )
-                accompaniment_notes.append(chord_note)
-        
-        return accompaniment_notes
-
+        # Count the pitch classes of every measure in one 12-slot histogram row
+        measure_indices = (starts * (1.0 / measure_duration)).astype(np.int64)
+        in_range = measure_indices < num_measures
+        slots = measure_indices[in_range] * 12 + pitch_classes[in_range]
+        pitch_counts = np.bincount(slots, minlength=num_measures * 12).reshape(num_measures, 12)
+        
+        # Position of the first note of each pitch class within the measure
+        first_seen = np.full(num_measures * 12, len(starts), dtype=np.int64)
+        np.minimum.at(first_seen, slots, np.arange(slots.size))
+        first_seen = first_seen.reshape(num_measures, 12)
+        
+        # Get the most common pitch as the root note, taking the one that
+        # appears first in the measure on ties
+        is_most_common = pitch_counts == pitch_counts.max(axis=1, keepdims=True)
+        root_pitches = np.where(is_most_common, first_seen, len(starts)).argmin(axis=1)
+        
+        # Generate chords for every measure that has melody notes
+        measures = np.flatnonzero(pitch_counts.any(axis=1))
+        roots = root_pitches[measures]
+        measure_counts = pitch_counts[measures]
+        rows = np.arange(measures.size)
+        
+        # Create a simple triad chord (root, third, fifth)
+        # Major chord: root, root+4, root+7
+        # Minor chord: root, root+3, root+7
+        
+        # Determine if major or minor based on the third most common in the melody
+        has_major_third = measure_counts[rows, (roots + 4) % 12] > 0
+        has_minor_third = measure_counts[rows, (roots + 3) % 12] > 0
+        
+        # Default to major if can't determine
+        is_major = ~(has_minor_third & ~has_major_third)
+        
+        # Create the chord in a lower octave
+        base_octave = 4  # Middle C octave
+        root_notes = roots + (base_octave - 1) * 12  # One octave lower
+        
+        third_intervals = np.where(is_major, 4, 3)
+        chord_pitches = np.stack([
+            root_notes,  # Root
+            root_notes + third_intervals,  # Third
+            root_notes + 7  # Fifth
+        ], axis=1)
+        
+        # Each chord tone is a whole note spanning its measure
+        chord_starts = np.repeat(measures * measure_duration, 3)
+        chord_ends = np.repeat((measures + 1) * measure_duration, 3)
+        
+        # Create the note objects only once all chords are known
+        return [
+            pretty_midi.Note(
+                velocity=70,  # Slightly softer than melody
+                pitch=pitch,
+                start=start,
+                end=end
+            )
+            for pitch, start, end in zip(chord_pitches.ravel().tolist(), chord_starts.tolist(), chord_ends.tolist())
+        ]
 
 # Example usage
 if __name__ == "__main__":
     # This code will only run if the file is executed directly
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    )
+    
     extractor = MelodyExtractor()
     
     # Example with a test file
@@ -8,17 +8,14 @@ It converts audio files to MIDI and extracts musical notes.
 import os
 import logging
 import tempfile
-from typing import Dict, Optional, Tuple
-import numpy as np
+from typing import TYPE_CHECKING, Dict, Optional, Tuple
 import pretty_midi
-from basic_pitch.inference import predict
-from basic_pitch import ICASSP_2022_MODEL_PATH
 
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-)
+if TYPE_CHECKING:
+    from basic_pitch.inference import Model
+
+from app.melody_extractor import MelodyExtractor
+
 logger = logging.getLogger(__name__)
 
 class MusicTranscriber:
@@ -26,6 +23,9 @@ class MusicTranscriber:
     Class for transcribing audio files to musical notes using Basic Pitch.
     """
     
+    # Basic Pitch model shared by all transcribers in the process
+    _model: Optional["Model"] = None
+    
     def __init__(self, output_dir: Optional[str] = None):
         """
         Initialize the music transcriber.
@@ -36,8 +36,31 @@ class MusicTranscriber:
         """
         self.output_dir = output_dir or tempfile.mkdtemp()
         os.makedirs(self.output_dir, exist_ok=True)
+        self.melody_extractor = MelodyExtractor(output_dir=self.output_dir)
         logger.info(f"Music transcriber initialized with output directory: {self.output_dir}")
     
+    @classmethod
+    def _get_model(cls) -> "Model":
+        """
+        Get the Basic Pitch model, loading it on first use.
+        
+        Returns:
+            Loaded Basic Pitch model
+        """
+        if cls._model is None:
+            # basic_pitch imports librosa and its inference runtime, so it is
+            # only loaded by the processes that actually transcribe audio
+            from basic_pitch import ICASSP_2022_MODEL_PATH
+            from basic_pitch.inference import Model
+            
+            # Basic Pitch picks the inference backend from the model file, so a
+            # deployment can point this at the SavedModel (TensorFlow, uses a GPU
+            # when available) or the ONNX export instead of the bundled default
+            model_path = os.environ.get("BASIC_PITCH_MODEL_PATH") or ICASSP_2022_MODEL_PATH
+            logger.info(f"Loading Basic Pitch model: {model_path}")
+            cls._model = Model(model_path)
+        return cls._model
+    
     def transcribe_audio(self, audio_path: str, task_id: str) -> Tuple[bool, Dict, str]:
         """
         Transcribe an audio file to MIDI using Basic Pitch.
@@ -61,10 +84,12 @@ class MusicTranscriber:
         try:
             logger.info(f"Transcribing audio file: {audio_path}")
             
+            from basic_pitch.inference import predict
+            
             # Predict pitches and onsets using Basic Pitch
             model_output, midi_data, note_events = predict(
                 audio_path,
-                model_or_model_path=ICASSP_2022_MODEL_PATH,
+                model_or_model_path=self._get_model(),
                 onset_threshold=0.5,
                 frame_threshold=0.3,
                 minimum_note_length=58,  # in ms
@@ -153,89 +178,17 @@ class MusicTranscriber:
                 - Dictionary of melody data
                 - Path to the generated melody MIDI file
         """
-        if not os.path.exists(midi_path):
-            logger.error(f"MIDI file does not exist: {midi_path}")
-            return False, {"error": "MIDI file not found"}, ""
-        
-        melody_midi_path = os.path.join(self.output_dir, f"{task_id}_melody.mid")
-        
-        try:
-            logger.info(f"Extracting main melody from MIDI: {midi_path}")
-            
-            # Load the MIDI file
-            midi_data = pretty_midi.PrettyMIDI(midi_path)
-            
-            # Find the instrument with the most notes in the highest pitch range
-            # This is a simple heuristic for finding the melody
-            best_instrument = None
-            highest_score = -1
-            
-            for instrument in midi_data.instruments:
-                if instrument.is_drum:
-                    continue
-                
-                if not instrument.notes:
-                    continue
-                
-                # Calculate the average pitch
-                pitches = [note.pitch for note in instrument.notes]
-                avg_pitch = sum(pitches) / len(pitches)
-                
-                # Calculate a score based on number of notes and average pitch
-                # Higher pitches and more notes are more likely to be the melody
-                score = len(instrument.notes) * (avg_pitch / 127.0)
-                
-                if score > highest_score:
-                    highest_score = score
-                    best_instrument = instrument
-            
-            if best_instrument is None:
-                logger.error("No suitable melody instrument found in MIDI")
-                return False, {"error": "No suitable melody instrument found"}, ""
-            
-            # Create a new MIDI file with just the melody
-            melody_midi = pretty_midi.PrettyMIDI()
-            
-            # Copy tempo and time signature information
-            for tempo_change in midi_data.get_tempo_changes()[1]:
-                melody_midi._tick_scales.append((0, 60.0 / tempo_change))
-            
-            for ts in midi_data.time_signature_changes:
-                melody_midi.time_signature_changes.append(ts)
-            
-            for ks in midi_data.key_signature_changes:
-                melody_midi.key_signature_changes.append(ks)
-            
-            # Create a new instrument for the melody
-            melody_instrument = pretty_midi.Instrument(
-                program=best_instrument.program,
-                name="Melody"
-            )
-            
-            # Add the notes from the best instrument
-            for note in best_instrument.notes:
-                melody_instrument.notes.append(note)
-            
-            melody_midi.instruments.append(melody_instrument)
-            
-            # Save the melody MIDI
-            melody_midi.write(melody_midi_path)
-            
-            # Extract basic information from the melody MIDI
-            melody_info = self._extract_midi_info(melody_midi)
-            melody_info["original_instrument"] = best_instrument.name or "Unknown"
-            
-            logger.info(f"Successfully extracted melody to MIDI: {melody_midi_path}")
-            return True, melody_info, melody_midi_path
-                
-        except Exception as e:
-            logger.error(f"Error extracting melody: {str(e)}")
-            return False, {"error": str(e)}, ""
-
+        # Delegate to the shared melody extractor so the heuristic lives in one place
+        return self.melody_extractor.extract_main_melody(midi_path, task_id)
 
 # Example usage
 if __name__ == "__main__":
     # This code will only run if the file is executed directly
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    )
+    
     transcriber = MusicTranscriber()
     
     # Example with a test file
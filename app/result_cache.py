@@ -0,0 +1,139 @@
+"""
+Result Cache Module for Piano Chorus Creator
+
+This module stores pipeline artifacts (arrangement MIDI files and sheet music PDFs)
+on disk keyed by a content hash, so identical inputs skip the expensive
+transcription and engraving steps.
+"""
+
+import os
+import shutil
+import hashlib
+import logging
+import tempfile
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+class ResultCache:
+    """
+    Class for caching pipeline artifacts by content hash with LRU eviction.
+    """
+    
+    def __init__(self, cache_dir: Optional[str] = None, max_entries: int = 256):
+        """
+        Initialize the result cache.
+        
+        Args:
+            cache_dir: Directory to store cached artifacts.
+                       If None, a temporary directory will be used.
+            max_entries: Maximum number of cached files kept on disk
+        """
+        self.cache_dir = cache_dir or tempfile.mkdtemp()
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self.max_entries = max_entries
+        logger.info(f"Result cache initialized with cache directory: {self.cache_dir}")
+    
+    def make_key(self, *parts: str) -> str:
+        """
+        Build a cache key from a sequence of strings.
+        
+        Args:
+            *parts: Values identifying the cached result
+        
+        Returns:
+            Hex digest identifying the result
+        """
+        return hashlib.blake2b("\0".join(parts).encode("utf-8"), digest_size=20).hexdigest()
+    
+    def hasher(self) -> "hashlib.blake2b":
+        """
+        Create a hasher for computing content keys incrementally.
+        
+        Returns:
+            New hash object; its hexdigest() is a valid cache key
+        """
+        return hashlib.blake2b(digest_size=20)
+    
+    def hash_file(self, file_path: str) -> str:
+        """
+        Compute the content hash of a file.
+        
+        Args:
+            file_path: Path to the file
+        
+        Returns:
+            Hex digest of the file contents
+        """
+        hasher = self.hasher()
+        with open(file_path, "rb") as f:
+            while chunk := f.read(1 << 20):
+                hasher.update(chunk)
+        return hasher.hexdigest()
+    
+    def fetch(self, key: str, suffix: str, dest_path: str) -> bool:
+        """
+        Copy a cached artifact to the given destination.
+        
+        Args:
+            key: Cache key
+            suffix: File suffix of the artifact (e.g. ".pdf")
+            dest_path: Path to copy the artifact to
+        
+        Returns:
+            bool: True on a cache hit, False otherwise
+        """
+        cache_path = self._path(key, suffix)
+        try:
+            shutil.copyfile(cache_path, dest_path)
+            # Refresh the modification time so eviction is least-recently-used
+            os.utime(cache_path)
+        except FileNotFoundError:
+            return False
+        except Exception as e:
+            logger.error(f"Error reading cached artifact: {str(e)}")
+            return False
+        
+        logger.info(f"Cache hit for {key}{suffix}")
+        return True
+    
+    def store(self, key: str, suffix: str, src_path: str) -> None:
+        """
+        Store an artifact in the cache.
+        
+        Args:
+            key: Cache key
+            suffix: File suffix of the artifact (e.g. ".pdf")
+            src_path: Path to the artifact to cache
+        """
+        cache_path = self._path(key, suffix)
+        try:
+            # Copy to a temporary name first so readers never see a partial file
+            fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix=".tmp")
+            os.close(fd)
+            shutil.copyfile(src_path, tmp_path)
+            os.replace(tmp_path, cache_path)
+        except Exception as e:
+            logger.error(f"Error caching artifact: {str(e)}")
+            return
+        
+        self._evict()
+    
+    def _path(self, key: str, suffix: str) -> str:
+        return os.path.join(self.cache_dir, f"{key}{suffix}")
+    
+    def _evict(self) -> None:
+        """
+        Remove the least recently used artifacts beyond the size limit.
+        """
+        try:
+            with os.scandir(self.cache_dir) as it:
+                entries = [e for e in it if e.is_file() and not e.name.endswith(".tmp")]
+            if len(entries) <= self.max_entries:
+                return
+            
+            entries.sort(key=lambda e: e.stat().st_mtime)
+            for entry in entries[:len(entries) - self.max_entries]:
+                os.remove(entry.path)
+        except Exception as e:
+            logger.error(f"Error evicting cached artifacts: {str(e)}")
@@ -6,20 +6,189 @@ from MIDI files using music21 and LilyPond.
 """
 
 import os
+import math
 import logging
+import shutil
 import tempfile
-from typing import Dict, Optional, Tuple, List
-import pretty_midi
-from music21 import converter, stream, note, chord, clef, meter, key, tempo, metadata
-from music21 import environment, midi
+import subprocess
+from functools import lru_cache
+from string import Template
+from typing import Dict, List, Optional, Tuple
+import mido
+import numpy as np
+from numba import njit, prange
+from music21 import stream, note, chord, pitch, clef, meter, key, tempo, metadata
+from music21 import environment
 
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-)
 logger = logging.getLogger(__name__)
 
+# Note offsets and durations are snapped to sixteenths or eighth-note triplets,
+# the same grid music21 uses when it imports MIDI
+QUARTER_LENGTH_DIVISORS = (4, 3)
+
+# Shortest note written out; shorter notes are hard to read for beginners
+MIN_QUARTER_LENGTH = 1 / max(QUARTER_LENGTH_DIVISORS)
+
+def _quantize(quarter_lengths: np.ndarray) -> np.ndarray:
+    """
+    Snap quarter lengths to the nearest point of the quantization grid.
+    
+    Args:
+        quarter_lengths: Offsets or durations in quarter notes
+        
+    Returns:
+        Quantized quarter lengths
+    """
+    candidates = np.stack([np.round(quarter_lengths * d) / d for d in QUARTER_LENGTH_DIVISORS])
+    errors = np.abs(candidates - quarter_lengths)
+    return np.take_along_axis(candidates, errors.argmin(axis=0)[np.newaxis], axis=0)[0]
+
+@njit("void(int64[::1], boolean[::1], float64[::1], float64, boolean[::1])", parallel=True, cache=True)
+def _split_hands(voices: np.ndarray, voice_is_right: np.ndarray, durations: np.ndarray, min_duration: float, right_mask: np.ndarray) -> None:
+    """
+    Look up the hand of every note from its voice and clamp its duration.
+    
+    Args:
+        voices: Voice of each note
+        voice_is_right: Whether each voice is played by the right hand
+        durations: Duration of each note, clamped in place
+        min_duration: Shortest duration kept
+        right_mask: Output mask of the right-hand notes
+    """
+    for i in prange(voices.shape[0]):
+        right_mask[i] = voice_is_right[voices[i]]
+        durations[i] = max(durations[i], min_duration)
+
+def _parse_key(key_name: str) -> key.Key:
+    """
+    Convert a MIDI key signature name such as 'Bb' or 'F#m' to a music21 key.
+    
+    Args:
+        key_name: Key name as reported by mido
+        
+    Returns:
+        music21 Key object
+    """
+    tonic = key_name[0] + key_name[1:].rstrip('m').replace('b', '-')
+    if key_name.endswith('m'):
+        return key.Key(tonic.lower())
+    return key.Key(tonic)
+
+# Pitch spelling matches music21's defaults for MIDI input
+PITCH_CLASS_NAMES = np.array(['c', 'cis', 'd', 'ees', 'e', 'f', 'fis', 'g', 'gis', 'a', 'bes', 'b'])
+
+# LilyPond octave marks indexed by MIDI octave; c' is middle C (60)
+OCTAVE_MARKS = np.array([",,,,", ",,,", ",,", ",", "", "'", "''", "'''", "''''", "'''''", "''''''"])
+
+# Durations are emitted in twelfths of a quarter note, the smallest unit that
+# holds both quantization grids. Plain note values, longest first:
+LILYPOND_DURATIONS = ((48, "1"), (36, "2."), (24, "2"), (18, "4."), (12, "4"), (9, "8."), (6, "8"), (3, "16"))
+
+# Triplet note values that make up the remainder of a duration that is not a
+# whole number of sixteenths, indexed by the remainder modulo 3
+LILYPOND_TRIPLETS = {1: ((4, "8"), (1, "32")), 2: ((2, "16"),)}
+
+# Declares the oldest LilyPond release the template's syntax needs, since
+# LilyPond refuses files whose version is newer than itself
+LILYPOND_TEMPLATE = Template(r'''\version "2.22.0"
+
+\header {
+  title = "$title"
+}
+
+global = {
+  \key $key_sig
+  \time $time_sig
+}
+
+\score {
+  \new PianoStaff <<
+    \new Staff { \clef treble \global \tempo 4 = $tempo $right_hand_notes }
+    \new Staff { \clef bass \global $left_hand_notes }
+  >>
+  \layout { }
+}
+''')
+
+@lru_cache(maxsize=None)
+def _lilypond_duration(units: int) -> Tuple[Tuple[str, bool], ...]:
+    """
+    Split a duration into LilyPond note values that are tied together.
+    
+    Args:
+        units: Duration in twelfths of a quarter note
+        
+    Returns:
+        Tuple of (note value, is triplet) pairs
+    """
+    triplets = []
+    remainder = units % 3
+    if remainder:
+        for triplet_units, value in LILYPOND_TRIPLETS[remainder]:
+            if triplet_units <= units:
+                triplets.append((value, True))
+                units -= triplet_units
+                break
+    
+    pieces = []
+    for value_units, value in LILYPOND_DURATIONS:
+        while units >= value_units:
+            pieces.append((value, False))
+            units -= value_units
+    
+    # Straight values first, so a triplet ends the note
+    return tuple(pieces + triplets)
+
+def _pitch_names(pitches: np.ndarray) -> np.ndarray:
+    """
+    Convert MIDI pitches to LilyPond note names.
+    
+    Args:
+        pitches: MIDI pitches
+        
+    Returns:
+        Array of LilyPond note names with octave marks
+    """
+    return np.char.add(np.take(PITCH_CLASS_NAMES, pitches % 12), np.take(OCTAVE_MARKS, pitches // 12, mode='clip'))
+
+def _lilypond_key(key_name: str) -> str:
+    """
+    Convert a MIDI key signature name such as 'Bb' or 'F#m' to LilyPond syntax.
+    
+    Args:
+        key_name: Key name as reported by mido
+        
+    Returns:
+        LilyPond key, e.g. 'bes \\major'
+    """
+    mode = '\\minor' if key_name.endswith('m') else '\\major'
+    tonic = key_name.rstrip('m')
+    return tonic[0].lower() + tonic[1:].replace('#', 'is').replace('b', 'es') + ' ' + mode
+
+def _configure_lilypond(env: environment.Environment) -> None:
+    """
+    Point a music21 environment at LilyPond if no path is configured yet.
+    
+    Args:
+        env: music21 environment to configure
+    """
+    try:
+        # Check if LilyPond is installed
+        lilypond_path = env['lilypondPath']
+        if not lilypond_path:
+            # Try to set the default path
+            env['lilypondPath'] = '/usr/bin/lilypond'
+            logger.info("Set LilyPond path to /usr/bin/lilypond")
+        else:
+            logger.info(f"Using LilyPond at: {lilypond_path}")
+    except Exception as e:
+        logger.warning(f"Could not configure LilyPond: {str(e)}")
+
+# Reading and updating music21's user settings is slow, so it happens once
+# on import rather than for every generator
+_ENV = environment.Environment()
+_configure_lilypond(_ENV)
+
 class SheetMusicGenerator:
     """
     Class for generating piano sheet music from MIDI files.
@@ -37,19 +206,14 @@ class SheetMusicGenerator:
         os.makedirs(self.output_dir, exist_ok=True)
         logger.info(f"Sheet music generator initialized with output directory: {self.output_dir}")
         
-        # Configure music21 environment to use LilyPond
-        self.env = environment.Environment()
-        try:
-            # Check if LilyPond is installed
-            lilypond_path = self.env.get('lilypondPath')
-            if not lilypond_path:
-                # Try to set the default path
-                self.env['lilypondPath'] = '/usr/bin/lilypond'
-                logger.info("Set LilyPond path to /usr/bin/lilypond")
-            else:
-                logger.info(f"Using LilyPond at: {lilypond_path}")
-        except Exception as e:
-            logger.warning(f"Could not configure LilyPond: {str(e)}")
+        # MuseScore engraves short scores faster than LilyPond, so it is
+        # preferred when installed
+        self.musescore_path = shutil.which('mscore') or shutil.which('musescore')
+        if self.musescore_path:
+            logger.info(f"Using MuseScore at: {self.musescore_path}")
+        
+        # The music21 environment is configured once per process
+        self.env = _ENV
     
     def generate_sheet_music(self, midi_path: str, task_id: str, title: str = "Piano Arrangement") -> Tuple[bool, Dict, str]:
         """
@@ -66,64 +230,206 @@ class SheetMusicGenerator:
                 - Dictionary of sheet music data
                 - Path to the generated PDF file
         """
-        if not os.path.exists(midi_path):
-            logger.error(f"MIDI file does not exist: {midi_path}")
-            return False, {"error": "MIDI file not found"}, ""
-        
         pdf_path = os.path.join(self.output_dir, f"{task_id}.pdf")
         
         try:
             logger.info(f"Generating sheet music from MIDI: {midi_path}")
             
-            # Load the MIDI file with music21
-            midi_score = converter.parse(midi_path)
-            
-            # Create a piano score
-            piano_score = self._create_piano_score(midi_score, title)
-            
-            # Write to PDF using LilyPond
+            # Read the notes of the MIDI file into arrays
             try:
-                # First try to write directly to PDF
-                piano_score.write(fmt='lily.pdf', fp=pdf_path)
-            except Exception as e:
-                logger.warning(f"Direct PDF generation failed: {str(e)}")
-                
-                # If direct PDF generation fails, try the two-step process
-                lily_path = os.path.join(self.output_dir, f"{task_id}.ly")
-                piano_score.write(fmt='lily', fp=lily_path)
-                
-                # Run LilyPond manually
-                import subprocess
-                cmd = ['/usr/bin/lilypond', '--pdf', '-o', os.path.splitext(pdf_path)[0], lily_path]
-                subprocess.run(cmd, check=True)
+                signatures, pitches, offsets, durations, voices = self._load_notes(midi_path)
+            except FileNotFoundError:
+                logger.error(f"MIDI file does not exist: {midi_path}")
+                return False, {"error": "MIDI file not found"}, ""
             
-            if os.path.exists(pdf_path):
-                logger.info(f"Successfully generated sheet music: {pdf_path}")
-                
-                # Extract basic information
-                sheet_music_info = {
-                    "title": title,
-                    "format": "PDF",
-                    "path": pdf_path,
-                    "measures": len(piano_score.getElementsByClass('Measure')),
-                    "duration": piano_score.duration.quarterLength
-                }
-                
-                return True, sheet_music_info, pdf_path
+            # Separate notes into right and left hand
+            right_mask = self._assign_hands(pitches, voices, durations)
+            
+            if self.musescore_path:
+                source_path = self._engrave_with_musescore(pdf_path, signatures, pitches, offsets, durations, right_mask, title)
             else:
+                source_path = self._engrave_with_lilypond(pdf_path, signatures, pitches, offsets, durations, right_mask, title)
+            
+            # LilyPond skips a zero-duration score with only a warning and
+            # exits successfully without writing a PDF
+            if not os.path.exists(pdf_path):
                 logger.error(f"PDF file was not generated: {pdf_path}")
-                return False, {"error": "PDF file was not generated"}, ""
+                return False, {"error": "PDF file was not generated", "source_path": source_path}, ""
+            
+            logger.info(f"Successfully generated sheet music: {pdf_path}")
+            
+            # Extract basic information
+            duration = float((offsets + durations).max()) if pitches.size else 0.0
+            sheet_music_info = {
+                "title": title,
+                "format": "PDF",
+                "path": pdf_path,
+                "measures": self._count_measures(duration, signatures["time_signature"]),
+                "duration": duration,
+                "source_path": source_path
+            }
+            
+            return True, sheet_music_info, pdf_path
                 
         except Exception as e:
             logger.error(f"Error generating sheet music: {str(e)}")
             return False, {"error": str(e)}, ""
     
-    def _create_piano_score(self, midi_score: stream.Score, title: str) -> stream.Score:
+    def _engrave_with_lilypond(
+        self,
+        pdf_path: str,
+        signatures: Dict,
+        pitches: np.ndarray,
+        offsets: np.ndarray,
+        durations: np.ndarray,
+        right_mask: np.ndarray,
+        title: str
+    ) -> str:
+        """
+        Engrave the piano score to PDF with LilyPond.
+        
+        Args:
+            pdf_path: Path of the PDF to write
+            signatures: Time signature, key signature and tempo of the file
+            pitches: MIDI pitch of each note
+            offsets: Offset of each note in quarter notes
+            durations: Duration of each note in quarter notes
+            right_mask: Boolean mask of the right-hand notes
+            title: Title for the sheet music
+            
+        Returns:
+            Path to the LilyPond source the PDF was engraved from
+        """
+        lily_path = os.path.splitext(pdf_path)[0] + ".ly"
+        
+        try:
+            # Fill the LilyPond template directly from the note arrays
+            self._write_lilypond(lily_path, signatures, pitches, offsets, durations, right_mask, title)
+        except Exception as e:
+            logger.warning(f"LilyPond template generation failed: {str(e)}")
+            
+            # Fall back to building a music21 score and its LilyPond output
+            piano_score = self._create_piano_score(signatures, pitches, offsets, durations, right_mask, title)
+            piano_score.write(fmt='lily', fp=lily_path)
+        
+        # Point-and-click links are only useful while editing
+        cmd = ['/usr/bin/lilypond', '--pdf', '-dno-point-and-click', '-o', os.path.splitext(pdf_path)[0], lily_path]
+        subprocess.run(cmd, check=True)
+        
+        return lily_path
+    
+    def _engrave_with_musescore(
+        self,
+        pdf_path: str,
+        signatures: Dict,
+        pitches: np.ndarray,
+        offsets: np.ndarray,
+        durations: np.ndarray,
+        right_mask: np.ndarray,
+        title: str
+    ) -> str:
         """
-        Create a piano score from a MIDI score.
+        Engrave the piano score to PDF with MuseScore.
         
         Args:
-            midi_score: music21 Score object from MIDI
+            pdf_path: Path of the PDF to write
+            signatures: Time signature, key signature and tempo of the file
+            pitches: MIDI pitch of each note
+            offsets: Offset of each note in quarter notes
+            durations: Duration of each note in quarter notes
+            right_mask: Boolean mask of the right-hand notes
+            title: Title for the sheet music
+            
+        Returns:
+            Path to the MusicXML source the PDF was engraved from
+        """
+        xml_path = os.path.splitext(pdf_path)[0] + ".musicxml"
+        
+        piano_score = self._create_piano_score(signatures, pitches, offsets, durations, right_mask, title)
+        piano_score.write(fmt='musicxml', fp=xml_path)
+        
+        # MuseScore needs no display when rendering offscreen
+        cmd = [self.musescore_path, '-o', pdf_path, xml_path]
+        subprocess.run(cmd, check=True, env={**os.environ, "QT_QPA_PLATFORM": "offscreen"})
+        
+        return xml_path
+    
+    def _load_notes(self, midi_path: str) -> Tuple[Dict, np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Read the notes and signatures of a MIDI file.
+        
+        Only note events and the time signature, key signature and tempo are
+        needed for the score, so they are read straight from the MIDI events
+        rather than building a full music21 stream.
+        
+        Args:
+            midi_path: Path to the MIDI file
+            
+        Returns:
+            Tuple containing:
+                - Time signature, key signature and tempo of the file (Dict)
+                - MIDI pitch of each note (np.ndarray)
+                - Offset of each note in quarter notes (np.ndarray)
+                - Duration of each note in quarter notes (np.ndarray)
+                - Index of the track each note belongs to (np.ndarray)
+        """
+        midi_file = mido.MidiFile(midi_path)
+        
+        # Defaults used when the file does not specify them
+        signatures = {"time_signature": "4/4", "key_signature": "C", "tempo": 120.0}
+        pitches = []
+        start_ticks = []
+        end_ticks = []
+        voices = []
+        
+        for track_index, track in enumerate(midi_file.tracks):
+            tick = 0
+            sounding = {}
+            for msg in track:
+                tick += msg.time
+                if msg.type == 'note_on' and msg.velocity > 0:
+                    sounding.setdefault((msg.channel, msg.note), []).append(tick)
+                elif msg.type in ('note_on', 'note_off'):
+                    # Close the earliest sounding note of this pitch
+                    onsets = sounding.get((msg.channel, msg.note))
+                    if onsets:
+                        pitches.append(msg.note)
+                        start_ticks.append(onsets.pop(0))
+                        end_ticks.append(tick)
+                        voices.append(track_index)
+                elif msg.type == 'time_signature':
+                    signatures["time_signature"] = f"{msg.numerator}/{msg.denominator}"
+                elif msg.type == 'key_signature':
+                    signatures["key_signature"] = msg.key
+                elif msg.type == 'set_tempo':
+                    signatures["tempo"] = round(mido.tempo2bpm(msg.tempo), 2)
+        
+        ticks_per_beat = midi_file.ticks_per_beat
+        start_ticks = np.asarray(start_ticks, dtype=np.float64)
+        end_ticks = np.asarray(end_ticks, dtype=np.float64)
+        offsets = _quantize(start_ticks / ticks_per_beat)
+        durations = _quantize((end_ticks - start_ticks) / ticks_per_beat)
+        
+        return signatures, np.asarray(pitches, dtype=np.int64), offsets, durations, np.asarray(voices, dtype=np.int64)
+    
+    def _create_piano_score(
+        self,
+        signatures: Dict,
+        pitches: np.ndarray,
+        offsets: np.ndarray,
+        durations: np.ndarray,
+        right_mask: np.ndarray,
+        title: str
+    ) -> stream.Score:
+        """
+        Create a piano score from the notes of a MIDI file.
+        
+        Args:
+            signatures: Time signature, key signature and tempo of the file
+            pitches: MIDI pitch of each note
+            offsets: Offset of each note in quarter notes
+            durations: Duration of each note in quarter notes
+            right_mask: Boolean mask of the right-hand notes
             title: Title for the sheet music
             
         Returns:
@@ -136,18 +442,9 @@ class SheetMusicGenerator:
         piano_score.metadata = metadata.Metadata()
         piano_score.metadata.title = title
         
-        # Extract time signature, key signature, and tempo from the original score
-        time_sig = meter.TimeSignature('4/4')  # Default
-        key_sig = key.Key('C')  # Default
-        tempo_mark = tempo.MetronomeMark(number=120)  # Default
-        
-        for element in midi_score.flat:
-            if isinstance(element, meter.TimeSignature):
-                time_sig = element
-            elif isinstance(element, key.KeySignature):
-                key_sig = element
-            elif isinstance(element, tempo.MetronomeMark):
-                tempo_mark = element
+        time_sig = meter.TimeSignature(signatures["time_signature"])
+        key_sig = _parse_key(signatures["key_signature"])
+        tempo_mark = tempo.MetronomeMark(number=signatures["tempo"])
         
         # Create right hand (treble) and left hand (bass) parts
         right_hand = stream.Part()
@@ -164,113 +461,231 @@ class SheetMusicGenerator:
         left_hand.append(key_sig)
         right_hand.append(tempo_mark)
         
-        # Separate notes into right and left hand
-        # For simplicity, we'll use a pitch threshold (middle C = 60)
-        # Notes above middle C go to right hand, notes below go to left hand
-        pitch_threshold = 60
-        
-        # Get all notes and chords
-        notes_and_chords = midi_score.flat.notesAndRests
-        
-        # Group by offset (start time)
-        offset_dict = {}
-        for element in notes_and_chords:
-            offset = element.offset
-            if offset not in offset_dict:
-                offset_dict[offset] = []
-            offset_dict[offset].append(element)
-        
-        # Process each offset group
-        for offset, elements in sorted(offset_dict.items()):
-            right_hand_elements = []
-            left_hand_elements = []
-            
-            for element in elements:
-                if element.isRest:
-                    # Add rests to both hands
-                    right_hand_elements.append(element)
-                    left_hand_elements.append(element)
-                elif element.isNote:
-                    # Assign notes based on pitch
-                    if element.pitch.midi >= pitch_threshold:
-                        right_hand_elements.append(element)
-                    else:
-                        left_hand_elements.append(element)
-                elif element.isChord:
-                    # Split chord between hands if it spans the threshold
-                    right_notes = []
-                    left_notes = []
-                    
-                    for pitch in element.pitches:
-                        if pitch.midi >= pitch_threshold:
-                            right_notes.append(pitch)
-                        else:
-                            left_notes.append(pitch)
-                    
-                    if right_notes:
-                        if len(right_notes) == 1:
-                            n = note.Note(right_notes[0])
-                            n.duration = element.duration
-                            right_hand_elements.append(n)
-                        else:
-                            c = chord.Chord(right_notes)
-                            c.duration = element.duration
-                            right_hand_elements.append(c)
-                    
-                    if left_notes:
-                        if len(left_notes) == 1:
-                            n = note.Note(left_notes[0])
-                            n.duration = element.duration
-                            left_hand_elements.append(n)
-                        else:
-                            c = chord.Chord(left_notes)
-                            c.duration = element.duration
-                            left_hand_elements.append(c)
-            
-            # Add elements to the respective hands
-            for element in right_hand_elements:
-                right_hand.insert(offset, element)
-            
-            for element in left_hand_elements:
-                left_hand.insert(offset, element)
+        # Fill each hand's part with its notes
+        self._build_part(right_hand, pitches[right_mask], offsets[right_mask], durations[right_mask])
+        self._build_part(left_hand, pitches[~right_mask], offsets[~right_mask], durations[~right_mask])
         
         # Add the parts to the score
         piano_score.append(right_hand)
         piano_score.append(left_hand)
         
-        # Make the score more readable for beginners
-        self._simplify_for_beginners(piano_score)
-        
         return piano_score
     
-    def _simplify_for_beginners(self, score: stream.Score) -> None:
+    def _build_part(self, part: stream.Part, pitches: np.ndarray, offsets: np.ndarray, durations: np.ndarray) -> None:
+        """
+        Add the notes of one hand to its part.
+        
+        Notes that start and end together form a chord, and the silences
+        between notes, which MIDI does not store, are filled with rests.
+        
+        Args:
+            part: music21 Part of the hand
+            pitches: MIDI pitch of each note
+            offsets: Offset of each note in quarter notes
+            durations: Duration of each note in quarter notes
+        """
+        if pitches.size == 0:
+            return
+        
+        # Group notes by (offset, duration), ordered by offset, and sort
+        # each group's pitches so chords are listed bottom to top
+        groups, group_index = np.unique(
+            np.column_stack((offsets, durations)), axis=0, return_inverse=True
+        )
+        group_index = group_index.ravel()
+        order = np.lexsort((pitches, group_index))
+        boundaries = np.flatnonzero(np.diff(group_index[order])) + 1
+        
+        # Insert without re-sorting the part after every element
+        for (offset, duration), group_pitches in zip(groups.tolist(), np.split(pitches[order], boundaries)):
+            if group_pitches.size == 1:
+                element = note.Note(int(group_pitches[0]))
+            else:
+                # Chords of plain MIDI numbers are respelled by a brute-force
+                # enharmonic search, so pass pitches with the default spelling
+                element = chord.Chord([pitch.Pitch(midi=midi) for midi in group_pitches.tolist()])
+            element.duration.quarterLength = duration
+            part.coreInsert(offset, element)
+        part.coreElementsChanged()
+        
+        part.makeRests(fillGaps=True, inPlace=True)
+    
+    def _assign_hands(self, pitches: np.ndarray, voices: np.ndarray, durations: np.ndarray) -> np.ndarray:
         """
-        Simplify the score to make it more suitable for beginner to intermediate players.
+        Decide which notes are played by the right hand, and simplify very
+        short durations, including notes that quantized to nothing, in the
+        same pass.
+        
+        Each voice stays in one hand, so a melody that dips below middle C is
+        not scattered across both staves. Voices whose mean pitch is at least
+        the median of all voice means go to the right hand. With a single voice
+        there is nothing to compare, so notes from middle C (60) upwards go to
+        the right hand and the rest to the left hand.
         
         Args:
-            score: music21 Score object to simplify
+            pitches: MIDI pitch of each note
+            voices: Voice (track) of each note
+            durations: Duration of each note, clamped in place
+            
+        Returns:
+            Boolean mask of the right-hand notes
         """
-        # Simplify complex rhythms
-        for part in score.parts:
-            for measure in part.getElementsByClass('Measure'):
-                for note_or_chord in measure.notesAndRests:
-                    # Simplify very short durations (32nd notes and shorter)
-                    if note_or_chord.duration.quarterLength < 0.125:
-                        note_or_chord.duration.quarterLength = 0.125  # 32nd note
-        
-        # Add fingering suggestions (simplified approach)
-        # This would require more complex logic for proper fingering
-        
-        # Add dynamics (simplified)
-        # This would require more complex analysis for proper dynamics
-        
-        # Add phrase markings (simplified)
-        # This would require more complex analysis for proper phrasing
+        pitch_threshold = 60
+        
+        # Voices are track indices, so they can be counted without sorting
+        counts = np.bincount(voices)
+        present = np.flatnonzero(counts)
+        if present.size < 2:
+            # Treat the notes on either side of middle C as two voices
+            voices = (pitches >= pitch_threshold).astype(np.int64)
+            voice_is_right = np.array([False, True])
+        else:
+            mean_pitches = np.bincount(voices, weights=pitches)[present] / counts[present]
+            voice_is_right = np.zeros(counts.size, dtype=np.bool_)
+            voice_is_right[present] = mean_pitches >= np.median(mean_pitches)
+        
+        right_mask = np.empty(pitches.size, dtype=np.bool_)
+        _split_hands(voices, voice_is_right, durations, MIN_QUARTER_LENGTH, right_mask)
+        return right_mask
+    
+    def _write_lilypond(
+        self,
+        lily_path: str,
+        signatures: Dict,
+        pitches: np.ndarray,
+        offsets: np.ndarray,
+        durations: np.ndarray,
+        right_mask: np.ndarray,
+        title: str
+    ) -> None:
+        """
+        Write the LilyPond source of the piano score.
+        
+        Args:
+            lily_path: Path of the .ly file to write
+            signatures: Time signature, key signature and tempo of the file
+            pitches: MIDI pitch of each note
+            offsets: Offset of each note in quarter notes
+            durations: Duration of each note in quarter notes
+            right_mask: Boolean mask of the right-hand notes
+            title: Title for the sheet music
+        """
+        numerator, denominator = map(int, signatures["time_signature"].split('/'))
+        bar_units = numerator * 48 // denominator
+        
+        source = LILYPOND_TEMPLATE.substitute(
+            title=title.replace('\\', '\\\\').replace('"', '\\"'),
+            key_sig=_lilypond_key(signatures["key_signature"]),
+            time_sig=signatures["time_signature"],
+            tempo=round(signatures["tempo"]),
+            right_hand_notes=self._lilypond_voice(pitches[right_mask], offsets[right_mask], durations[right_mask], bar_units),
+            left_hand_notes=self._lilypond_voice(pitches[~right_mask], offsets[~right_mask], durations[~right_mask], bar_units)
+        )
+        
+        with open(lily_path, "w", encoding="utf-8") as f:
+            f.write(source)
+    
+    def _lilypond_voice(self, pitches: np.ndarray, offsets: np.ndarray, durations: np.ndarray, bar_units: int) -> str:
+        """
+        Render the notes of one hand as a single LilyPond voice.
+        
+        Notes starting together form a chord lasting as long as its longest
+        note, cut short where the next chord starts; gaps become rests.
+        
+        Args:
+            pitches: MIDI pitch of each note
+            offsets: Offset of each note in quarter notes
+            durations: Duration of each note in quarter notes
+            bar_units: Length of a measure in twelfths of a quarter note
+            
+        Returns:
+            LilyPond music expression
+        """
+        if pitches.size == 0:
+            return ""
+        
+        # Notes are normally read in onset order already, so only sort by
+        # onset, then pitch, when some pair is out of order
+        steps = np.diff(offsets)
+        if np.any(steps < 0) or np.any((steps == 0) & (np.diff(pitches) < 0)):
+            order = np.lexsort((pitches, offsets))
+            pitches, offsets, durations = pitches[order], offsets[order], durations[order]
+        
+        # Find where each chord starts
+        group_starts = np.flatnonzero(np.diff(offsets, prepend=-np.inf))
+        onsets = offsets[group_starts]
+        names = np.split(_pitch_names(pitches), group_starts[1:])
+        
+        # Work in twelfths of a quarter note so every value is an integer
+        ends = np.maximum.reduceat(offsets + durations, group_starts)
+        ends = np.minimum(ends, np.append(onsets[1:], np.inf))
+        onset_units = np.rint(onsets * 12).astype(np.int64)
+        end_units = np.rint(ends * 12).astype(np.int64)
+        rest_units = onset_units - np.concatenate(([0], end_units[:-1]))
+        
+        events = []
+        for chord_names, start, length, rest in zip(names, onset_units.tolist(), (end_units - onset_units).tolist(), rest_units.tolist()):
+            if rest > 0:
+                events.extend(self._lilypond_event("r", start - rest, rest, bar_units, tie=False))
+            token = chord_names[0] if chord_names.size == 1 else f"<{' '.join(chord_names)}>"
+            events.extend(self._lilypond_event(token, start, length, bar_units, tie=True))
+        
+        return " ".join(events)
+    
+    def _lilypond_event(self, token: str, start: int, units: int, bar_units: int, tie: bool) -> List[str]:
+        """
+        Render a note, chord or rest, split at bar lines.
+        
+        Args:
+            token: Note name, chord or 'r' for a rest
+            start: Onset in twelfths of a quarter note
+            units: Duration in twelfths of a quarter note
+            bar_units: Length of a measure in twelfths of a quarter note
+            tie: Whether to tie the pieces of a split duration together
+            
+        Returns:
+            List of LilyPond events
+        """
+        pieces = []
+        segment = min(units, bar_units - start % bar_units)
+        while units > 0:
+            pieces.extend(_lilypond_duration(segment))
+            units -= segment
+            segment = min(units, bar_units)
+        
+        events = []
+        for i, (value, triplet) in enumerate(pieces):
+            event = f"{token}{value}"
+            if tie and i < len(pieces) - 1:
+                event += "~"
+            if triplet:
+                event = f"\\tuplet 3/2 {{ {event} }}"
+            events.append(event)
+        return events
+    
+    def _count_measures(self, duration: float, time_signature: str) -> int:
+        """
+        Count the measures the score fills.
+        
+        Args:
+            duration: Length of the score in quarter notes
+            time_signature: Time signature, e.g. '3/4'
+            
+        Returns:
+            Number of measures
+        """
+        numerator, denominator = map(int, time_signature.split('/'))
+        return math.ceil(duration / (numerator * 4 / denominator))
 
 
 # Example usage
 if __name__ == "__main__":
     # This code will only run if the file is executed directly
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    )
+    
     generator = SheetMusicGenerator()
     
     # Example with a test file
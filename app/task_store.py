@@ -0,0 +1,103 @@
+"""
+Task Store Module for Piano Chorus Creator
+
+This module keeps track of processing task state in a bounded in-memory store.
+Old tasks expire after a fixed lifetime and the least recently updated tasks are
+evicted once the store is full, so memory use stays flat over the process lifetime.
+"""
+
+import time
+import logging
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+class TaskStore:
+    """
+    Class for storing task state with LRU eviction and a time-to-live.
+    """
+    
+    def __init__(self, maxsize: int = 10_000, ttl: float = 3600.0):
+        """
+        Initialize the task store.
+        
+        Args:
+            maxsize: Maximum number of tasks kept in memory
+            ttl: Number of seconds a task is kept after its last update
+        """
+        self.maxsize = maxsize
+        self.ttl = ttl
+        
+        # task_id -> (last update timestamp, task fields), oldest first
+        self._tasks: "OrderedDict[str, tuple]" = OrderedDict()
+        
+        # Background tasks update state from worker threads
+        self._lock = threading.Lock()
+        logger.info(f"Task store initialized with maxsize={maxsize}, ttl={ttl}s")
+    
+    def get(self, task_id: str) -> Optional[Dict[str, Any]]:
+        """
+        Get a snapshot of a task's state.
+        
+        Args:
+            task_id: Task identifier
+        
+        Returns:
+            Copy of the task fields, or None if the task is unknown or expired
+        """
+        with self._lock:
+            self._expire(time.monotonic())
+            entry = self._tasks.get(task_id)
+            return dict(entry[1]) if entry else None
+    
+    def update(self, task_id: str, **fields: Any) -> None:
+        """
+        Create or update a task, refreshing its expiry time.
+        
+        Args:
+            task_id: Task identifier
+            **fields: Task fields to set
+        """
+        with self._lock:
+            now = time.monotonic()
+            entry = self._tasks.pop(task_id, None)
+            task = entry[1] if entry else {}
+            task.update(fields)
+            self._tasks[task_id] = (now, task)
+            
+            self._expire(now)
+            while len(self._tasks) > self.maxsize:
+                evicted_id, _ = self._tasks.popitem(last=False)
+                logger.info(f"Evicted task from store: {evicted_id}")
+    
+    def add_files(self, task_id: str, *file_paths: str) -> None:
+        """
+        Record files written for a task so they can be cleaned up later.
+        
+        Args:
+            task_id: Task identifier
+            *file_paths: Paths of the files to record
+        """
+        with self._lock:
+            entry = self._tasks.get(task_id)
+            if entry:
+                entry[1].setdefault("files", []).extend(p for p in file_paths if p)
+    
+    def __contains__(self, task_id: str) -> bool:
+        return self.get(task_id) is not None
+    
+    def _expire(self, now: float) -> None:
+        """
+        Drop tasks whose last update is older than the TTL.
+        
+        Args:
+            now: Current monotonic timestamp
+        """
+        # Entries are ordered by last update, so stop at the first live one
+        while self._tasks:
+            task_id, (updated_at, _) = next(iter(self._tasks.items()))
+            if now - updated_at < self.ttl:
+                break
+            del self._tasks[task_id]
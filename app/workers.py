@@ -0,0 +1,277 @@
+"""
+Workers Module for Piano Chorus Creator
+
+This module runs the sheet music generation pipeline on a dedicated pool of
+worker threads, so long-running transcription work never competes with the
+threads FastAPI uses to serve requests. The CPU-bound stages can additionally
+be offloaded to a process pool so they run outside the API process's GIL.
+"""
+
+import os
+import logging
+from concurrent.futures import Executor, Future
+from typing import Any, Callable, Optional, Tuple
+
+from app.task_store import TaskStore
+from app.result_cache import ResultCache
+from app.youtube_downloader import YouTubeDownloader
+from app.audio_processor import AudioProcessor
+from app.music_transcriber import MusicTranscriber
+from app.melody_extractor import MelodyExtractor
+from app.sheet_music_generator import SheetMusicGenerator
+
+logger = logging.getLogger(__name__)
+
+class PipelineWorker:
+    """
+    Class for running processing tasks on a bounded worker pool.
+    """
+    
+    def __init__(
+        self,
+        task_store: TaskStore,
+        result_cache: ResultCache,
+        youtube_downloader: YouTubeDownloader,
+        audio_processor: AudioProcessor,
+        music_transcriber: MusicTranscriber,
+        melody_extractor: MelodyExtractor,
+        sheet_music_generator: SheetMusicGenerator,
+        executor: Executor,
+        stage_executor: Optional[Executor] = None
+    ):
+        """
+        Initialize the pipeline worker.
+        
+        Args:
+            task_store: Store used to publish task progress
+            result_cache: Cache of previously generated artifacts
+            youtube_downloader: Component for downloading YouTube audio
+            audio_processor: Component for processing audio files
+            music_transcriber: Component for transcribing audio to MIDI
+            melody_extractor: Component for extracting the melody
+            sheet_music_generator: Component for generating the PDF
+            executor: Thread pool that runs tasks and publishes their progress
+            stage_executor: Optional process pool for the CPU-bound stages.
+                            If None, stages run on the task's thread.
+        """
+        self.task_store = task_store
+        self.result_cache = result_cache
+        self.youtube_downloader = youtube_downloader
+        self.audio_processor = audio_processor
+        self.music_transcriber = music_transcriber
+        self.melody_extractor = melody_extractor
+        self.sheet_music_generator = sheet_music_generator
+        
+        self.executor = executor
+        self.stage_executor = stage_executor
+        logger.info("Pipeline worker initialized")
+    
+    def submit(self, task: Callable, *args) -> Future:
+        """
+        Queue a task for execution on the worker pool.
+        
+        Args:
+            task: Task function to run
+            *args: Arguments passed to the task
+        
+        Returns:
+            Future for the queued task
+        """
+        return self.executor.submit(task, *args)
+    
+    def shutdown(self, wait: bool = True) -> None:
+        """
+        Stop the worker pools.
+        
+        Args:
+            wait: Whether to wait for running tasks to finish
+        """
+        # Tasks that have not started yet are dropped
+        self.executor.shutdown(wait=wait, cancel_futures=True)
+        if self.stage_executor is not None:
+            self.stage_executor.shutdown(wait=wait, cancel_futures=True)
+    
+    def _run_stage(self, stage: Callable, *args) -> Any:
+        """
+        Run a CPU-bound pipeline stage, on the process pool if one is configured.
+        
+        Args:
+            stage: Bound component method to run
+            *args: Arguments passed to the stage
+        
+        Returns:
+            The stage's return value
+        """
+        if self.stage_executor is None:
+            return stage(*args)
+        return self.stage_executor.submit(stage, *args).result()
+    
+    def process_youtube_task(self, task_id: str, url: str, title: Optional[str] = None):
+        """
+        Process a YouTube URL to generate sheet music.
+        
+        Args:
+            task_id: Unique task identifier
+            url: YouTube URL
+            title: Optional title for the sheet music
+        """
+        try:
+            # The same URL and title always produce the same sheet music
+            url_key = self.result_cache.make_key("youtube", url, title or "")
+            if self.complete_from_cache(task_id, url_key):
+                return
+            
+            self.task_store.update(task_id, status="downloading", progress=10)
+            
+            # Download audio from YouTube
+            success, audio_path, download_info = self.youtube_downloader.download_audio(url, task_id)
+            self.task_store.add_files(task_id, audio_path)
+            if not success:
+                self.task_store.update(task_id, status="failed", message=f"Failed to download audio: {download_info.get('error', 'Unknown error')}")
+                return
+            
+            # Use video title if no title provided
+            if not title:
+                title = download_info.get("title", "Piano Arrangement")
+            
+            pdf_path = self._generate_from_audio(task_id, audio_path, title, progress=(30, 50, 70, 85))
+            if pdf_path:
+                self.result_cache.store(url_key, ".pdf", pdf_path)
+        
+        except Exception as e:
+            logger.error(f"Error processing YouTube task: {str(e)}")
+            self.task_store.update(task_id, status="failed", message=f"An unexpected error occurred: {str(e)}")
+    
+    def process_audio_task(self, task_id: str, audio_path: str, title: Optional[str] = None, upload_key: Optional[str] = None):
+        """
+        Process an audio file to generate sheet music.
+        
+        Args:
+            task_id: Unique task identifier
+            audio_path: Path to the audio file
+            title: Optional title for the sheet music
+            upload_key: Optional cache key of the uploaded file, used to
+                        memoize the resulting PDF for identical uploads
+        """
+        try:
+            pdf_path = self._generate_from_audio(task_id, audio_path, title or "Piano Arrangement", progress=(20, 40, 60, 80))
+            if pdf_path and upload_key:
+                self.result_cache.store(upload_key, ".pdf", pdf_path)
+        
+        except Exception as e:
+            logger.error(f"Error processing audio task: {str(e)}")
+            self.task_store.update(task_id, status="failed", message=f"An unexpected error occurred: {str(e)}")
+    
+    def _generate_from_audio(self, task_id: str, audio_path: str, title: str, progress: Tuple[int, int, int, int]) -> Optional[str]:
+        """
+        Run the pipeline from audio processing through sheet music generation.
+        
+        Intermediate results are memoized by the hash of the processed audio, so
+        resubmitted audio skips transcription and, for the same title, engraving.
+        Sheet music is also memoized by the hash of the arrangement MIDI, so any
+        audio that yields an already engraved arrangement skips engraving.
+        
+        Args:
+            task_id: Unique task identifier
+            audio_path: Path to the audio file
+            title: Title for the sheet music
+            progress: Progress values reported when each pipeline stage starts
+            
+        Returns:
+            Path to the generated PDF, or None if the task failed
+        """
+        self.task_store.update(task_id, status="processing", progress=progress[0])
+        
+        # Process the audio
+        success, processed_audio_path, process_info = self._run_stage(self.audio_processor.process_audio, audio_path, task_id)
+        self.task_store.add_files(task_id, processed_audio_path)
+        if not success:
+            self.task_store.update(task_id, status="failed", message=f"Failed to process audio: {process_info.get('error', 'Unknown error')}")
+            return None
+        
+        audio_key = self.result_cache.hash_file(processed_audio_path)
+        pdf_key = self.result_cache.make_key(audio_key, title)
+        cached_pdf_path = self.complete_from_cache(task_id, pdf_key)
+        if cached_pdf_path:
+            return cached_pdf_path
+        
+        arrangement_midi_path = os.path.join(self.melody_extractor.output_dir, f"{task_id}_arrangement.mid")
+        if self.result_cache.fetch(audio_key, ".mid", arrangement_midi_path):
+            self.task_store.add_files(task_id, arrangement_midi_path)
+        else:
+            self.task_store.update(task_id, status="transcribing", progress=progress[1])
+            
+            # Transcribe the audio to MIDI
+            success, midi_info, midi_path = self._run_stage(self.music_transcriber.transcribe_audio, processed_audio_path, task_id)
+            self.task_store.add_files(task_id, midi_path)
+            if not success:
+                self.task_store.update(task_id, status="failed", message=f"Failed to transcribe audio: {midi_info.get('error', 'Unknown error')}")
+                return None
+            
+            self.task_store.update(task_id, status="extracting_melody", progress=progress[2])
+            
+            # Extract the main melody with accompaniment
+            success, arrangement_info, arrangement_midi_path = self._run_stage(self.melody_extractor.extract_with_accompaniment, midi_path, task_id)
+            self.task_store.add_files(task_id, arrangement_midi_path)
+            if not success:
+                self.task_store.update(task_id, status="failed", message=f"Failed to extract melody: {arrangement_info.get('error', 'Unknown error')}")
+                return None
+            
+            self.result_cache.store(audio_key, ".mid", arrangement_midi_path)
+        
+        # Different audio can still produce an identical arrangement, whose
+        # sheet music only depends on the arrangement and the title
+        arrangement_pdf_key = self.result_cache.make_key("arrangement", self.result_cache.hash_file(arrangement_midi_path), title)
+        cached_pdf_path = self.complete_from_cache(task_id, arrangement_pdf_key)
+        if cached_pdf_path:
+            self.result_cache.store(pdf_key, ".pdf", cached_pdf_path)
+            return cached_pdf_path
+        
+        self.task_store.update(task_id, status="generating_sheet_music", progress=progress[3])
+        
+        # Generate sheet music
+        success, sheet_info, pdf_path = self._run_stage(self.sheet_music_generator.generate_sheet_music, arrangement_midi_path, task_id, title)
+        self.task_store.add_files(task_id, sheet_info.get("source_path"))
+        if not success:
+            self.task_store.update(task_id, status="failed", message=f"Failed to generate sheet music: {sheet_info.get('error', 'Unknown error')}")
+            return None
+        
+        self.result_cache.store(pdf_key, ".pdf", pdf_path)
+        self.result_cache.store(arrangement_pdf_key, ".pdf", pdf_path)
+        self._complete_task(task_id, pdf_path)
+        return pdf_path
+    
+    def complete_from_cache(self, task_id: str, key: str) -> Optional[str]:
+        """
+        Complete a task with a cached PDF if one exists for the given key.
+        
+        Args:
+            task_id: Unique task identifier
+            key: Cache key of the sheet music PDF
+            
+        Returns:
+            Path to the task's PDF on a cache hit, None otherwise
+        """
+        pdf_path = os.path.join(self.sheet_music_generator.output_dir, f"{task_id}.pdf")
+        if not self.result_cache.fetch(key, ".pdf", pdf_path):
+            return None
+        
+        self._complete_task(task_id, pdf_path)
+        return pdf_path
+    
+    def _complete_task(self, task_id: str, pdf_path: str) -> None:
+        """
+        Mark a task as completed.
+        
+        Args:
+            task_id: Unique task identifier
+            pdf_path: Path to the generated PDF
+        """
+        self.task_store.update(
+            task_id,
+            status="completed",
+            progress=100,
+            message="Sheet music generated successfully",
+            pdf_path=pdf_path,
+            download_url=f"/api/download/{task_id}"
+        )
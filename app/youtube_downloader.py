@@ -5,34 +5,83 @@ This module handles downloading audio from YouTube videos using yt-dlp.
 """
 
 import os
+import re
+import sys
+import json
+import time
+import hashlib
 import logging
 import tempfile
-from typing import Dict, Optional, Tuple
+import threading
+import subprocess
+from functools import lru_cache
+from typing import Dict, List, Optional, Tuple
 import yt_dlp
 
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-)
+from app.audio_processor import TARGET_SAMPLE_RATE
+
 logger = logging.getLogger(__name__)
 
+# Plain YouTube watch and short links, accepted without consulting yt-dlp
+YOUTUBE_URL_RE = re.compile(r'^https?://(?:www\.|m\.)?(?:youtube\.com/watch\?v=|youtu\.be/)[\w-]{6,}')
+
+# Video info is reused for an hour; the stream URLs in it expire after a few
+INFO_CACHE_TTL = 3600  # seconds
+
+@lru_cache(maxsize=1)
+def _extractors() -> List:
+    """
+    Instantiate yt-dlp's extractors once per process.
+    
+    Returns:
+        List of extractor instances
+    """
+    return yt_dlp.extractor.gen_extractors()
+
 class YouTubeDownloader:
     """
     Class for downloading audio from YouTube videos.
     """
     
-    def __init__(self, output_dir: Optional[str] = None):
+    def __init__(
+        self,
+        output_dir: Optional[str] = None,
+        audio_format: str = "wav",
+        sample_rate: Optional[int] = TARGET_SAMPLE_RATE
+    ):
         """
         Initialize the YouTube downloader.
         
         Args:
             output_dir: Directory to save downloaded audio files.
                         If None, a temporary directory will be used.
+            audio_format: Extension of the downloaded audio, which selects FFmpeg's encoder
+                          (e.g. "wav" or "mp3"). WAV is the default since it needs no
+                          encoding and is decoded again right away by the audio processor.
+            sample_rate: Sample rate the audio is downmixed to mono and resampled to
+                         while it is converted. If None, the source channels and rate are kept.
         """
         self.output_dir = output_dir or tempfile.mkdtemp()
         os.makedirs(self.output_dir, exist_ok=True)
+        self.info_cache_dir = os.path.join(self.output_dir, "info_cache")
+        os.makedirs(self.info_cache_dir, exist_ok=True)
+        self.audio_format = audio_format
         logger.info(f"YouTube downloader initialized with output directory: {self.output_dir}")
+        
+        # FFmpeg options applied while converting the downloaded stream
+        self.convert_args = ['-ac', '1', '-ar', str(sample_rate)] if sample_rate else []
+        
+        self.info_opts = {
+            'format': 'bestaudio/best',
+            'quiet': True,
+            'no_warnings': True,
+            'skip_download': True,
+        }
+        
+        # One extractor instance is kept so its HTTP connections are reused
+        # between videos; it is not thread-safe, so calls are serialized
+        self._ydl = yt_dlp.YoutubeDL(self.info_opts)
+        self._ydl_lock = threading.Lock()
     
     def validate_url(self, url: str) -> bool:
         """
@@ -44,8 +93,10 @@ class YouTubeDownloader:
         Returns:
             bool: True if valid, False otherwise
         """
-        extractors = yt_dlp.extractor.gen_extractors()
-        for e in extractors:
+        if YOUTUBE_URL_RE.match(url):
+            return True
+        
+        for e in _extractors():
             if e.suitable(url) and e.IE_NAME != 'generic':
                 return True
         return False
@@ -68,41 +119,115 @@ class YouTubeDownloader:
             logger.error(f"Invalid YouTube URL: {url}")
             return False, "", {"error": "Invalid YouTube URL"}
         
-        output_file = os.path.join(self.output_dir, f"{task_id}.mp3")
-        
-        ydl_opts = {
-            'format': 'bestaudio/best',
-            'postprocessors': [{
-                'key': 'FFmpegExtractAudio',
-                'preferredcodec': 'mp3',
-                'preferredquality': '192',
-            }],
-            'outtmpl': output_file.replace('.mp3', ''),  # yt-dlp adds extension automatically
-            'quiet': False,
-            'no_warnings': False,
-            'ignoreerrors': False,
-        }
+        output_file = os.path.join(self.output_dir, f"{task_id}.{self.audio_format}")
         
         try:
             logger.info(f"Downloading audio from {url}")
-            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                info = ydl.extract_info(url, download=True)
-                
-            if os.path.exists(output_file):
-                logger.info(f"Successfully downloaded audio to {output_file}")
-                return True, output_file, {
-                    "title": info.get('title', ''),
-                    "duration": info.get('duration', 0),
-                    "uploader": info.get('uploader', ''),
-                }
-            else:
-                logger.error(f"Download completed but file not found: {output_file}")
-                return False, "", {"error": "Download completed but file not found"}
+            
+            # The download reads the cached info, so the page is not extracted twice
+            info, info_path = self._load_info(url)
+            # Raises unless both the download and the conversion succeeded
+            self._stream_audio(info_path, output_file)
+            
+            logger.info(f"Successfully downloaded audio to {output_file}")
+            return True, output_file, {
+                "title": info.get('title', ''),
+                "duration": info.get('duration', 0),
+                "uploader": info.get('uploader', ''),
+            }
                 
         except Exception as e:
             logger.error(f"Error downloading from YouTube: {str(e)}")
             return False, "", {"error": str(e)}
     
+    def _load_info(self, url: str) -> Tuple[Dict, str]:
+        """
+        Get the full yt-dlp info of a video, cached on disk by URL.
+        
+        Args:
+            url: YouTube URL
+            
+        Returns:
+            Tuple containing:
+                - yt-dlp info dictionary (Dict)
+                - Path to the cached info JSON (str)
+        """
+        info_path = os.path.join(self.info_cache_dir, f"{hashlib.sha256(url.encode('utf-8')).hexdigest()}.json")
+        try:
+            if time.time() - os.stat(info_path).st_mtime < INFO_CACHE_TTL:
+                with open(info_path, encoding="utf-8") as f:
+                    return json.load(f), info_path
+        except (OSError, ValueError):
+            pass
+        
+        with self._ydl_lock:
+            info = self._ydl.sanitize_info(self._ydl.extract_info(url, download=False))
+        
+        # Write to a temporary name first so readers never see a partial file
+        fd, tmp_path = tempfile.mkstemp(dir=self.info_cache_dir, suffix=".tmp")
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(info, f)
+        os.replace(tmp_path, info_path)
+        
+        self._prune_info_cache()
+        return info, info_path
+    
+    def _prune_info_cache(self) -> None:
+        """
+        Remove cached video info older than the cache TTL.
+        """
+        expired = time.time() - INFO_CACHE_TTL
+        try:
+            with os.scandir(self.info_cache_dir) as entries:
+                for entry in entries:
+                    if entry.stat().st_mtime < expired:
+                        os.remove(entry.path)
+        except OSError as e:
+            logger.error(f"Error pruning video info cache: {str(e)}")
+    
+    def _stream_audio(self, info_path: str, output_file: str) -> None:
+        """
+        Download an audio stream and convert it on the fly.
+        
+        yt-dlp writes the stream to a pipe that FFmpeg reads from, so only the
+        converted file is ever written to disk.
+        
+        Args:
+            info_path: Path to the video info JSON written by yt-dlp
+            output_file: Path of the converted audio file
+            
+        Raises:
+            RuntimeError: If the download or the conversion fails
+        """
+        download_cmd = [
+            sys.executable, '-m', 'yt_dlp', '--quiet', '--no-warnings',
+            '--format', 'bestaudio/best', '--load-info-json', info_path, '--output', '-'
+        ]
+        convert_cmd = ['ffmpeg', '-loglevel', 'error', '-i', 'pipe:0', '-vn', *self.convert_args, '-y', output_file]
+        
+        with tempfile.TemporaryFile() as download_errors:
+            download = subprocess.Popen(download_cmd, stdout=subprocess.PIPE, stderr=download_errors)
+            try:
+                convert = subprocess.Popen(convert_cmd, stdin=download.stdout, stderr=subprocess.PIPE)
+            except Exception:
+                download.kill()
+                download.wait()
+                raise
+            finally:
+                # Only FFmpeg holds the read end now, so yt-dlp stops if FFmpeg exits
+                download.stdout.close()
+            _, convert_errors = convert.communicate()
+            download.wait()
+            
+            # When FFmpeg fails first, yt-dlp dies on the closed pipe, so
+            # FFmpeg's error is the one that explains what went wrong
+            if convert.returncode != 0:
+                raise RuntimeError(f"FFmpeg failed: {convert_errors.decode(errors='replace').strip()}")
+            
+            if download.returncode != 0:
+                download_errors.seek(0)
+                raise RuntimeError(f"yt-dlp failed: {download_errors.read().decode(errors='replace').strip()}")
+    
     def get_video_info(self, url: str) -> Dict:
         """
         Get information about a YouTube video without downloading.
@@ -117,17 +242,9 @@ class YouTubeDownloader:
             logger.error(f"Invalid YouTube URL: {url}")
             return {"error": "Invalid YouTube URL"}
         
-        ydl_opts = {
-            'format': 'bestaudio/best',
-            'quiet': True,
-            'no_warnings': True,
-            'skip_download': True,
-        }
-        
         try:
-            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                info = ydl.extract_info(url, download=False)
-                
+            info, _ = self._load_info(url)
+            
             return {
                 "title": info.get('title', ''),
                 "duration": info.get('duration', 0),
@@ -143,6 +260,11 @@ class YouTubeDownloader:
 # Example usage
 if __name__ == "__main__":
     # This code will only run if the file is executed directly
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    )
+    
     downloader = YouTubeDownloader()
     test_url = "https://www.youtube.com/watch?v=dQw4w9WgXcQ"  # Example URL
     